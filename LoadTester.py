@@ -2,85 +2,530 @@
 import flask
 import requests
 import threading
+import multiprocessing
+import queue
+import asyncio
+import ssl
 import time
 import json
 import random
-from collections import Counter
+import math
+import mmap
+import os
+import struct
+import socket
+import re
+import itertools
+import bisect
+from concurrent.futures import ThreadPoolExecutor
+try: import numpy
+except ImportError: numpy = None
+from collections import Counter, deque
 from argparse import ArgumentParser
+from urllib.parse import urlsplit, urljoin, quote
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.connection import HTTPConnection, HTTPSConnection
 
-# --- 1. LÓGICA DA APLICAÇÃO (Sem alterações) ---
+# --- 1. LÓGICA DA APLICAÇÃO (estado do teste, coleta de resultados e motor de threads) ---
 app = flask.Flask(__name__)
 
 test_state = { "status": "idle", "params": {}, "live_stats": {"total": 0}, "results": [], "summary": {}, "time_series_data": [] }
 state_lock = threading.Lock()
+# Caminho de gravação sem contenção: os usuários virtuais só fazem deque.append (atômico sob o GIL) e consultam stop_event;
+# um único coletor drena a fila para os agregadores, protegidos por metrics_lock, que nenhum worker adquire.
+stop_event = threading.Event()
+result_queue = deque()
+metrics_lock = threading.Lock()
+# Serializa drain_results inteiro (retirada, agregação, log e resultados brutos); sempre adquirido antes dos demais locks.
+drain_lock = threading.Lock()
+COLLECT_INTERVAL = 0.05
+AGENT_REPORT_INTERVAL = 1.0
+AGENT_HTTP_TIMEOUT = 10
+AGENT_MAX_FAILURES = 5
+DEFAULT_MAX_IN_FLIGHT = 1000
+SEND_LATE_THRESHOLD = 0.01
+SCHEDULE_FLUSH_INTERVAL = 0.5
+RESULTS_LOG_FLUSH_INTERVAL = 0.5
+STREAM_DEFAULT_RATE, STREAM_MIN_RATE, STREAM_MAX_RATE = 1.0, 0.2, 10.0
+STATUS_MAX_POINTS = 360
+RESULTS_PAGE_LIMIT = 10000
+results_log = None
+generator_monitor = None
+MONITOR_INTERVAL = 0.5
+LOOP_PROBE_INTERVAL = 0.1
+MONITOR_CPU_SATURATION = 90.0
+MONITOR_LAG_SATURATION = 0.05
+AUTO_TUNE_STREAK = 4
+AUTO_TUNE_RETIRE_FRACTION = 0.1
+REQUEST_TIMEOUT = 30
+DEFAULT_POOL_SIZE = 100
+# Modos de conexão: 'new' (nova conexão por requisição), 'per_user' (sessão keep-alive por usuário virtual) e 'keep_alive' (pool compartilhado).
+CONNECTION_MODES = ("new", "per_user", "keep_alive")
+# Respostas que o cliente asyncio segue pelo Location, como requests (REDIRECT_STATI).
+REDIRECT_STATUSES = (301, 302, 303, 307, 308)
 
 def data_aggregator():
-    last_processed_index = 0
+    last_tick = time.time()
     while True:
         time.sleep(10)
+        now = time.time(); interval_duration, last_tick = now - last_tick, now
+        with metrics_lock: interval_counts, interval_histograms, interval_schedule, interval_transfer, interval_generator = metrics.take_interval()
         with state_lock:
             if test_state["status"] not in ["ramping", "running"]:
-                last_processed_index = 0
                 test_state["time_series_data"] = []
                 continue
-            current_results_count = len(test_state["results"])
-            new_results = test_state["results"][last_processed_index:]
-            last_processed_index = current_results_count
-            if not new_results:
+            if not interval_counts and not interval_schedule:
                 continue
-            interval_duration = 10.0
-            interval_counts = Counter(categorize_result(r['status_code']) for r in new_results)
-            rates = { category: f"{interval_counts.get(category, 0) / interval_duration:.2f}" for category in ['success', 'rate_limit', 'client_error', 'server_error', 'network_error'] }
-            success_times = [r["duration"] for r in new_results if categorize_result(r['status_code']) == 'success']
-            avg_response_time = sum(success_times) / len(success_times) if success_times else 0
-            interval_data = { "timestamp": time.strftime('%H:%M:%S'), "rates": rates, "avg_response_time": f"{avg_response_time:.4f}", }
+            success_histogram = interval_histograms.get('success', LatencyHistogram())
+            interval_data = interval_point(now, interval_duration, interval_counts, success_histogram.mean(), *(success_histogram.percentile(q) for q in (0.50, 0.95, 0.99)))
+            if interval_schedule: interval_data.update({"intended_rps": f"{interval_schedule['intended'] / interval_duration:.2f}", "dropped": interval_schedule["dropped"], "late": interval_schedule["late"]})
+            phase_sums, phase_counts = interval_transfer["phase_sums"], interval_transfer["phase_counts"]
+            if phase_counts:
+                interval_data["phases"] = {phase: f"{phase_sums[phase] / phase_counts[phase]:.4f}" for phase in PHASES if phase_counts[phase]}
+                interval_data["throughput"] = f"{interval_transfer['bytes'] / interval_duration:.0f}"
+            if interval_generator["samples"]:
+                interval_data["generator"] = {"cpu": f"{interval_generator['cpu_sum'] / interval_generator['samples']:.1f}", "lag": f"{interval_generator['lag_max']:.4f}",
+                    "drift": f"{interval_generator['drift_max']:.4f}", "users": interval_generator["users_max"], "saturated": interval_generator["saturated"] > 0}
             test_state["time_series_data"].append(interval_data)
+        status_stream.publish_interval(interval_data)
 
-def user_simulation(params, headers):
-    for _ in range(params.get("reqs_per_user", 1)):
-        with state_lock:
-            if test_state["status"] not in ["ramping", "running"]: break
-        result = worker(params["url"], params["method"], headers, params["body"])
-        with state_lock:
-            if test_state["status"] in ["ramping", "running"]: test_state["results"].append(result)
-        try:
-            delay = random.uniform(params.get('delay_min', 0.5), params.get('delay_max', 2.0)) if params.get('delay_type') == 'variable' else params.get('delay_constant', 1.0)
-            time.sleep(delay)
-        except (ValueError, KeyError): time.sleep(0)
+def interval_point(timestamp, interval_duration, counts, avg_response_time, p50, p95, p99):
+    rates = { category: f"{counts.get(category, 0) / interval_duration:.2f}" for category in CATEGORIES }
+    return { "timestamp": time.strftime('%H:%M:%S', time.localtime(timestamp)), "rates": rates, "avg_response_time": f"{avg_response_time:.4f}", "p50": f"{p50:.4f}", "p95": f"{p95:.4f}", "p99": f"{p99:.4f}", }
 
-def worker(url, method, headers, body):
-    start_time = time.time()
-    result = {"status_code": None, "duration": 0, "error": None}
+def result_collector():
+    while True:
+        time.sleep(COLLECT_INTERVAL)
+        drain_results()
+
+def drain_results():
+    # drain_lock cobre o lote inteiro, até o log e os resultados brutos: quem chama drain_results() no fim do teste espera
+    # o lote que o coletor já retirou, e só então o resumo é calculado e o log fechado.
+    with drain_lock:
+        with metrics_lock:
+            batch = []
+            try:
+                while True: batch.append(result_queue.popleft())
+            except IndexError: pass
+            for result in batch: metrics.record(result)
+        log = results_log
+        if batch and log: log.append(batch)
+        if batch and param_enabled(test_state["params"], "keep_raw_results"):
+            with state_lock: test_state["results"].extend(batch)
+
+def record_result(result):
+    if not stop_event.is_set(): result_queue.append(result)
+
+def param_enabled(params, key):
+    return str(params.get(key, "")).lower() in ("on", "1", "true", "yes")
+
+def next_delay(params):
+    try: return random.uniform(params.get('delay_min', 0.5), params.get('delay_max', 2.0)) if params.get('delay_type') == 'variable' else float(params.get('delay_constant', 1.0))
+    except (ValueError, KeyError, TypeError): return 0
+
+def connection_mode(params):
+    mode = params.get("connection_mode", "new")
+    return mode if mode in CONNECTION_MODES else "new"
+
+def pool_size(params):
+    try: return max(1, int(params.get("pool_size", DEFAULT_POOL_SIZE)))
+    except (ValueError, TypeError): return DEFAULT_POOL_SIZE
+
+# Fases de cada requisição em time.perf_counter (monotônico): dns, connect e tls só existem quando a conexão é aberta
+# pela requisição; ttfb vai do início do envio até o primeiro byte da resposta (no motor threads, até o fim dos
+# cabeçalhos, que é quando o urllib3 devolve o controle) e body é a leitura do corpo.
+PHASES = ("dns", "connect", "tls", "ttfb", "body")
+
+class PhaseTimingConnectionMixin:
+    def _new_conn(self):
+        # Resolve o nome aqui para separar DNS de connect; se o primeiro endereço falhar e houver outros, o urllib3 refaz tudo.
+        self.phase_timings = timings = {}
+        started = time.perf_counter()
+        try: addresses = socket.getaddrinfo(self._dns_host, self.port, 0, socket.SOCK_STREAM)
+        except OSError: return super()._new_conn()
+        resolved = time.perf_counter()
+        dns_host, self._dns_host = self._dns_host, addresses[0][4][0]
+        try: sock = super()._new_conn()
+        except Exception:
+            if len(addresses) == 1: raise
+            self._dns_host = dns_host; sock = super()._new_conn()
+        finally: self._dns_host = dns_host
+        timings["dns"], timings["connect"] = resolved - started, time.perf_counter() - resolved
+        return sock
+
+class PhaseTimingHTTPConnection(PhaseTimingConnectionMixin, HTTPConnection): pass
+
+class PhaseTimingHTTPSConnection(PhaseTimingConnectionMixin, HTTPSConnection):
+    def connect(self):
+        started = time.perf_counter()
+        super().connect()
+        timings = self.phase_timings
+        if timings: timings["tls"] = time.perf_counter() - started - timings["dns"] - timings["connect"]
+
+# O urllib3 só abre o socket dentro de _make_request; se a conexão retirada do pool já tem socket, ela está sendo reutilizada.
+class ReuseTrackingPoolMixin:
+    def _make_request(self, conn, *args, **kwargs):
+        reused = getattr(conn, "sock", None) is not None
+        conn.phase_timings = {}
+        started = time.perf_counter()
+        response = super()._make_request(conn, *args, **kwargs)
+        phases = conn.phase_timings
+        phases["ttfb"] = time.perf_counter() - started - sum(phases.values())
+        response.connection_reused, response.phase_timings = reused, phases
+        return response
+
+class ReuseTrackingHTTPConnectionPool(ReuseTrackingPoolMixin, HTTPConnectionPool): ConnectionCls = PhaseTimingHTTPConnection
+class ReuseTrackingHTTPSConnectionPool(ReuseTrackingPoolMixin, HTTPSConnectionPool): ConnectionCls = PhaseTimingHTTPSConnection
+
+# Modo 'new': a conexão é fechada ao voltar ao pool, então cada salto de redirect abre a sua (como o cliente asyncio).
+class FreshConnectionPoolMixin:
+    def _put_conn(self, conn):
+        if conn is not None: conn.close()
+        super()._put_conn(conn)
+
+class FreshHTTPConnectionPool(FreshConnectionPoolMixin, ReuseTrackingHTTPConnectionPool): pass
+class FreshHTTPSConnectionPool(FreshConnectionPoolMixin, ReuseTrackingHTTPSConnectionPool): pass
+
+class ReuseTrackingAdapter(HTTPAdapter):
+    def __init__(self, *args, fresh_connections=False, **kwargs):
+        self.pool_classes = {"http": FreshHTTPConnectionPool, "https": FreshHTTPSConnectionPool} if fresh_connections else {"http": ReuseTrackingHTTPConnectionPool, "https": ReuseTrackingHTTPSConnectionPool}
+        super().__init__(*args, **kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = self.pool_classes
+
+def raw_attribute(response, name, default=None):
+    # urllib3 2.x devolve a própria HTTPResponse em _make_request; no 1.x ela fica em _original_response (http.client).
+    raw = response.raw
+    return getattr(raw, name, None) or getattr(getattr(raw, "_original_response", None), name, default)
+
+def response_reused(response):
+    return bool(raw_attribute(response, "connection_reused", False))
+
+def create_session(maxsize, fresh_connections=False):
+    # pool_block=False: conexões acima do limite são abertas e descartadas em vez de bloquear o usuário virtual (o pool retido é limitado a maxsize).
+    session = requests.Session(); adapter = ReuseTrackingAdapter(pool_connections=10, pool_maxsize=maxsize, pool_block=False, fresh_connections=fresh_connections)
+    session.mount("http://", adapter); session.mount("https://", adapter)
+    return session
+
+def user_simulation(params, template, feeder=None, session=None):
+    own_session = create_session(1) if connection_mode(params) == "per_user" else None
+    try:
+        for _ in range(params.get("reqs_per_user", 1)):
+            if stop_event.is_set() or retire_user(): break
+            result = worker(template, own_session or session, variables=next_variables(feeder))
+            record_result(result)
+            pause(next_delay(params))
+    finally:
+        if own_session: own_session.close()
+
+def scenario_simulation(params, scenario, feeder=None, session=None):
+    own_session = create_session(1) if connection_mode(params) == "per_user" else None
+    variables = scenario.user_variables(feeder)
     try:
-        req_body = json.loads(body) if body else None
-        response = requests.request(method, url, headers=headers, json=req_body, timeout=30)
-        result["status_code"] = response.status_code
+        for sequence in scenario.iterations(params.get("reqs_per_user", 1)):
+            for step in sequence:
+                if stop_event.is_set() or retire_user(): return
+                record_result(worker(step.template, own_session or session, variables=variables, step=step))
+                pause(step.think(params))
+    finally:
+        if own_session: own_session.close()
+
+def worker(template, session=None, scheduled_at=None, variables=None, step=None):
+    # scheduled_at, quando vem do modelo aberto, está no mesmo relógio monotônico (time.perf_counter).
+    start_time = time.perf_counter() if scheduled_at is None else scheduled_at
+    result = {"status_code": None, "duration": 0, "error": None, "connection_reused": None}
+    if step: result["step"] = step.name
+    try:
+        if template.error: result["error"] = template.error
+        else:
+            response = send_prepared(session, *template.prepare(variables))
+            result["status_code"] = response.status_code
+            result["connection_reused"] = response_reused(response)
+            result["phases"] = {**(raw_attribute(response, "phase_timings") or {}), "body": response.body_time}
+            # tell() conta os bytes lidos do socket (antes da descompressão), mas o urllib3 não o atualiza em respostas chunked.
+            result["bytes"] = response.raw.tell() or len(response.content)
+            if step and step.extractors and response.status_code < 400: variables.update(step.extract(response.content))
     except requests.exceptions.RequestException as e: result["error"] = str(e)
-    except json.JSONDecodeError as e: result["error"] = f"JSON Body Error: {e}"
-    result["duration"] = time.time() - start_time
+    result["duration"] = time.perf_counter() - start_time; result["timestamp"] = time.time()
     return result
 
-def run_load_test(params):
+def send_prepared(session, prepared, settings):
+    # Sem sessão (modo 'new') faz o mesmo que requests.request: uma sessão descartável por requisição, sem reaproveitar a
+    # conexão nem entre os saltos de um redirect.
+    # stream=True só separa a leitura do corpo (fase body); o conteúdo é lido inteiro aqui, como faria o send padrão.
+    if session is None:
+        with create_session(1, fresh_connections=True) as one_shot: return send_prepared(one_shot, prepared, settings)
+    response = session.send(prepared, timeout=REQUEST_TIMEOUT, stream=True, **settings)
+    headers_at = time.perf_counter()
+    response.content
+    response.body_time = time.perf_counter() - headers_at
+    return response
+
+# --- 1.1 MOTOR ASYNCIO (milhares de usuários como corrotinas em um único event loop) ---
+# Cliente HTTP/1.1 mínimo baseado apenas na stdlib: cada usuário virtual é uma corrotina
+# em vez de uma thread, e os registros de resultado são idênticos aos de worker().
+
+class AsyncConnectionPool:
+    def __init__(self, maxsize, ssl_context):
+        self.maxsize, self.ssl_context, self.idle = maxsize, ssl_context, {}
+
+    async def acquire(self, key, phases=None):
+        idle = self.idle.get(key)
+        while idle:
+            reader, writer = idle.pop()
+            if not reader.at_eof() and not writer.is_closing(): return reader, writer, True
+            writer.close()
+        return (*await open_connection(key, self.ssl_context, phases), False)
+
+    def release(self, key, reader, writer, reusable):
+        idle = self.idle.setdefault(key, [])
+        if reusable and len(idle) < self.maxsize: idle.append((reader, writer))
+        else: writer.close()
+
+    def close(self):
+        for idle in self.idle.values():
+            for _, writer in idle: writer.close()
+        self.idle.clear()
+
+async def open_connection(key, ssl_context, phases=None):
+    # DNS, connect e handshake TLS em etapas separadas (o socket já conectado é entregue ao open_connection só para o TLS),
+    # tentando os endereços resolvidos em ordem, como faz asyncio.open_connection.
+    host, port, secure = key
+    loop, started = asyncio.get_running_loop(), time.perf_counter()
+    addresses = await loop.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+    resolved, error = time.perf_counter(), None
+    for family, socket_type, proto, _, address in addresses:
+        sock = socket.socket(family, socket_type, proto); sock.setblocking(False)
+        try: await loop.sock_connect(sock, address); break
+        except OSError as e: sock.close(); error = e
+    else: raise error or OSError(f"Could not resolve {host}")
+    connected = time.perf_counter()
+    try: connection = await asyncio.open_connection(sock=sock, ssl=(ssl_context or ssl.create_default_context()) if secure else None, server_hostname=host if secure else None)
+    except BaseException: sock.close(); raise
+    if phases is not None:
+        phases["dns"], phases["connect"] = resolved - started, connected - resolved
+        if secure: phases["tls"] = time.perf_counter() - connected
+    return connection
+
+async def async_user_simulation(params, template, feeder, ssl_context, pool=None):
+    own_pool = AsyncConnectionPool(1, ssl_context) if connection_mode(params) == "per_user" else None
+    try:
+        for _ in range(params.get("reqs_per_user", 1)):
+            if stop_event.is_set() or retire_user(): break
+            result = await async_worker(template, ssl_context, own_pool or pool, variables=next_variables(feeder))
+            record_result(result)
+            await async_pause(next_delay(params))
+    finally:
+        if own_pool: own_pool.close()
+
+async def async_scenario_simulation(params, scenario, feeder, ssl_context, pool=None):
+    own_pool = AsyncConnectionPool(1, ssl_context) if connection_mode(params) == "per_user" else None
+    variables = scenario.user_variables(feeder)
+    try:
+        for sequence in scenario.iterations(params.get("reqs_per_user", 1)):
+            for step in sequence:
+                if stop_event.is_set() or retire_user(): return
+                record_result(await async_worker(step.template, ssl_context, own_pool or pool, variables=variables, step=step))
+                await async_pause(step.think(params))
+    finally:
+        if own_pool: own_pool.close()
+
+async def async_worker(template, ssl_context=None, pool=None, scheduled_at=None, variables=None, step=None, timed=True):
+    start_time = time.perf_counter() if scheduled_at is None else scheduled_at
+    result = {"status_code": None, "duration": 0, "error": None, "connection_reused": None}
+    if step: result["step"] = step.name
+    try:
+        if template.error: result["error"] = template.error
+        else:
+            key, payload = template.payload(variables, keep_alive=pool is not None)
+            keep_body, phases = bool(step and step.extractors), {} if timed else None
+            result["status_code"], result["connection_reused"], body, received = await asyncio.wait_for(follow_redirects(template, variables, key, payload, ssl_context, pool, keep_body, phases), timeout=REQUEST_TIMEOUT)
+            if phases is not None: result["phases"], result["bytes"] = phases, received
+            if keep_body and result["status_code"] < 400: variables.update(step.extract(body))
+    except asyncio.TimeoutError: result["error"] = f"Request timed out after {REQUEST_TIMEOUT}s"
+    except asyncio.IncompleteReadError as e: result["error"] = f"Connection closed before full response ({len(e.partial)} bytes read)"
+    except (OSError, ValueError) as e: result["error"] = str(e) or e.__class__.__name__
+    result["duration"] = time.perf_counter() - start_time; result["timestamp"] = time.time()
+    return result
+
+async def follow_redirects(template, variables, key, payload, ssl_context, pool=None, keep_body=False, phases=None):
+    # Segue Location como Session.send (allow_redirects=True) para que os dois motores gravem o mesmo resultado: até
+    # DEFAULT_REDIRECT_LIMIT saltos, com o método e o corpo reescritos por redirect_request. Phases e bytes são do último salto.
+    method, url = template.method, None
+    for _ in range(requests.models.DEFAULT_REDIRECT_LIMIT + 1):
+        status_code, reused, body, received, location = await http_request(key, payload, method, ssl_context, pool, keep_body, phases)
+        if location is None: return status_code, reused, body, received
+        if url is None: url, headers, request_body = template.render(variables)
+        method, url, headers, request_body = redirect_request(method, url, headers, request_body, status_code, location)
+        key, payload = request_payload(method, url, headers, request_body, keep_alive=pool is not None)
+    raise ValueError(f"Exceeded {requests.models.DEFAULT_REDIRECT_LIMIT} redirects.")
+
+def redirect_request(method, url, headers, body, status_code, location):
+    # Mesmas regras de requests.Session.rebuild_method / rebuild_auth.
+    target = urljoin(url, location)
+    if (status_code == 303 and method != "HEAD") or (status_code == 302 and method != "HEAD") or (status_code == 301 and method == "POST"): method = "GET"
+    if status_code not in (307, 308):
+        body, headers = None, {k: v for k, v in headers.items() if k.lower() not in ("content-length", "content-type", "transfer-encoding")}
+    old, new = urlsplit(url), urlsplit(target)
+    upgraded = old.scheme == "http" and new.scheme == "https" and old.port in (80, None) and new.port in (443, None)
+    if old.hostname != new.hostname or (old.scheme, old.port) != (new.scheme, new.port) and not upgraded:
+        headers = {k: v for k, v in headers.items() if k.lower() != "authorization"}
+    return method, target, headers, body
+
+async def http_request(key, payload, method, ssl_context, pool=None, keep_body=False, phases=None):
+    # Devolve também o Location das respostas de redirect (None nas demais), seguido por follow_redirects.
+    while True:
+        if phases: phases.clear()
+        reader, writer, reused = await pool.acquire(key, phases) if pool else (*await open_connection(key, ssl_context, phases), False)
+        reusable = False
+        try:
+            if phases is not None: phases["sent"] = time.perf_counter()
+            writer.write(payload)
+            await writer.drain()
+            status_code, response_headers, reusable, body, received = await read_response(reader, method, keep_body, phases)
+            return status_code, reused, body, received, response_headers.get("location") if status_code in REDIRECT_STATUSES else None
+        except (OSError, asyncio.IncompleteReadError):
+            # Conexão ociosa fechada pelo servidor: repete uma única vez em uma conexão nova, como faz o urllib3.
+            if not reused: raise
+        finally:
+            if pool: pool.release(key, reader, writer, reusable)
+            else: writer.close()
+
+def build_request(method, parts, headers, req_body, keep_alive=False):
+    path = (parts.path or "/") + (f"?{parts.query}" if parts.query else "")
+    request_headers = {"Host": parts.netloc.rsplit("@", 1)[-1], "User-Agent": "LoadTester-asyncio", "Accept": "*/*", "Connection": "keep-alive" if keep_alive else "close"}
+    if req_body is not None: request_headers.update({"Content-Type": "application/json", "Content-Length": str(len(req_body))})
+    lowered = {k.lower(): k for k in request_headers}
+    for k, v in headers.items(): request_headers.pop(lowered.get(k.lower(), k), None); request_headers[k] = v
+    head = f"{method} {path} HTTP/1.1\r\n" + "".join(f"{k}: {v}\r\n" for k, v in request_headers.items()) + "\r\n"
+    return head.encode("latin-1") + (req_body or b"")
+
+async def read_response(reader, method, keep_body=False, phases=None):
+    # O corpo só é guardado quando alguém vai lê-lo (extract de cenário); nos demais casos é consumido e descartado.
+    # Com phases, "sent" (gravado por http_request) vira ttfb e a leitura após os cabeçalhos vira body; received conta os bytes do corpo.
+    while True:
+        status_line = await reader.readline()
+        if not status_line: raise ConnectionResetError("Connection closed by server before response")
+        if phases is not None and "ttfb" not in phases: phases["ttfb"] = time.perf_counter() - phases.pop("sent")
+        parts = status_line.split(None, 2)
+        if len(parts) < 2 or not parts[0].startswith(b"HTTP/") or not parts[1].isdigit(): raise ConnectionError(f"Invalid HTTP status line: {status_line[:100]!r}")
+        status_code, response_headers = int(parts[1]), {}
+        while (line := await reader.readline()) not in (b"\r\n", b"\n", b""):
+            k, _, v = line.decode("latin-1").partition(":"); response_headers[k.strip().lower()] = v.strip()
+        if not 100 <= status_code < 200: break
+    reusable, chunks, received = parts[0] == b"HTTP/1.1" and response_headers.get("connection", "").lower() != "close", [] if keep_body else None, 0
+    headers_at = time.perf_counter() if phases is not None else None
+    if method == "HEAD" or status_code in (204, 304): pass
+    elif "chunked" in response_headers.get("transfer-encoding", "").lower():
+        while (size := int((await reader.readline()).split(b";", 1)[0].strip() or b"0", 16)) > 0:
+            chunk = await reader.readexactly(size + 2); received += size
+            if keep_body: chunks.append(chunk[:-2])
+        while (await reader.readline()) not in (b"\r\n", b"\n", b""): pass
+    elif "content-length" in response_headers:
+        chunk = await reader.readexactly(int(response_headers["content-length"])); received += len(chunk)
+        if keep_body: chunks.append(chunk)
+    else:
+        while chunk := await reader.read(65536):
+            received += len(chunk)
+            if keep_body: chunks.append(chunk)
+        reusable = False
+    if phases is not None: phases["body"] = time.perf_counter() - headers_at
+    return status_code, response_headers, reusable, b"".join(chunks) if keep_body else None, received
+
+def raise_fd_limit():
+    # Cada usuário virtual com conexão aberta consome um descritor; o limite padrão (1024) não comporta dezenas de milhares.
+    try:
+        import resource
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        if hard == resource.RLIM_INFINITY or soft < hard: resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    except (ImportError, ValueError, OSError): pass
+
+def ramp_up_interval(params):
+    users_to_start, ramp_up_duration = params.get("users", 1), params.get("ramp_up", 0)
+    return ramp_up_duration / users_to_start if ramp_up_duration > 0 and users_to_start > 0 else 0
+
+def run_users_threaded(params, plan, feeder=None):
     threads = []
-    start_time = time.time()
-    with state_lock: test_state['start_time'] = start_time
-    try: headers = {k.strip(): v.strip() for line in params.get("headers", "").strip().split("\n") if ":" in line for k, v in [line.split(":", 1)]}
-    except Exception: headers = {}
-    with state_lock: test_state["status"] = "ramping"
-    users_to_start = params.get("users", 1)
-    ramp_up_duration = params.get("ramp_up", 0)
-    ramp_up_interval = ramp_up_duration / users_to_start if ramp_up_duration > 0 and users_to_start > 0 else 0
-    for _ in range(users_to_start):
-        with state_lock:
-            if test_state["status"] not in ["ramping", "running"]: break
-        thread = threading.Thread(target=user_simulation, args=(params, headers)); threads.append(thread); thread.start()
-        time.sleep(ramp_up_interval)
+    interval = ramp_up_interval(params)
+    session = create_session(pool_size(params)) if connection_mode(params) == "keep_alive" else None
+    simulation = scenario_simulation if isinstance(plan, Scenario) else user_simulation
+    track_users(lambda: sum(thread.is_alive() for thread in threads))
+    stop_event.wait(params.get("ramp_offset", 0))
+    for _ in range(params.get("users", 1)):
+        if stop_event.is_set() or not hold_ramp(): break
+        thread = threading.Thread(target=simulation, args=(params, plan, feeder, session)); threads.append(thread); thread.start()
+        pause(interval)
     with state_lock:
         if test_state["status"] == "ramping": test_state["status"] = "running"
     for thread in threads: thread.join()
-    duration = time.time() - start_time
+    if session: session.close()
+
+async def run_users_async(params, plan, feeder=None):
+    tasks = []
+    interval, ssl_context = ramp_up_interval(params), ssl.create_default_context()
+    pool = AsyncConnectionPool(pool_size(params), ssl_context) if connection_mode(params) == "keep_alive" else None
+    simulation = async_scenario_simulation if isinstance(plan, Scenario) else async_user_simulation
+    track_users(lambda: sum(not task.done() for task in tasks)); probe = asyncio.ensure_future(loop_lag_probe())
+    await asyncio.sleep(params.get("ramp_offset", 0))
+    for _ in range(params.get("users", 1)):
+        if stop_event.is_set() or not await async_hold_ramp(): break
+        tasks.append(asyncio.ensure_future(simulation(params, plan, feeder, ssl_context, pool)))
+        await async_pause(interval)
     with state_lock:
-        test_state["summary"] = calculate_summary(test_state["results"], duration); test_state["status"] = "finished"
+        if test_state["status"] == "ramping": test_state["status"] = "running"
+    await asyncio.gather(*tasks)
+    probe.cancel()
+    if pool: pool.close()
+
+def run_load_test(params):
+    global results_log, generator_monitor
+    start_time = time.time()
+    results_log = None
+    # O finally garante que o teste sempre termina em "finished" (senão todo /start_test seguinte recebe 409) e que o
+    # monitor e o log são encerrados; um erro inesperado aparece em test_state["error"].
+    try:
+        # Em modo distribuído os resultados brutos ficam nos shards: cada processo local grava o caminho recebido do
+        # controlador (RESULTS_PATH) e cada agente remoto grava o próprio log se tiver --results-dir.
+        if app.config.get("RESULTS_PATH"): results_log = ResultsLogWriter(app.config["RESULTS_PATH"], start_time)
+        elif app.config.get("RESULTS_DIR") and not is_distributed(params):
+            results_log = ResultsLogWriter(os.path.join(app.config["RESULTS_DIR"], time.strftime("results_%Y%m%d_%H%M%S.ltlog", time.localtime(start_time))), start_time)
+        with state_lock: test_state['start_time'] = start_time; test_state["results_log"] = results_log and results_log.path
+        with state_lock: test_state["status"] = "ramping"
+        # Cada processo que gera carga monitora a si mesmo; o controlador distribuído só soma as amostras dos shards.
+        generator_monitor = None if is_distributed(params) else GeneratorMonitor(params).start()
+        if is_distributed(params): run_distributed(params)
+        else:
+            try: plan, feeder = Scenario.from_params(params) or RequestTemplate.from_params(params), DataFeeder.from_params(params)
+            except ValueError as e:
+                with state_lock: test_state["error"] = str(e)
+            else: run_local(params, plan, feeder)
+    except Exception as e:
+        with state_lock: test_state["error"] = test_state.get("error") or f"Load test failed: {e.__class__.__name__}: {e}"
+        raise
+    finally:
+        duration = time.time() - start_time
+        monitor, generator_monitor = generator_monitor, None
+        if monitor: monitor.stop()
+        drain_results()
+        with drain_lock:
+            if results_log: results_log.close(); results_log = None
+        with metrics_lock: summary = metrics.summary(duration)
+        if monitor and monitor.auto_tune and "generator" in summary: summary["generator"]["auto_tune"] = {"ramp_paused": f"{monitor.ramp_paused:.1f}", "retired_users": monitor.retired}
+        with state_lock:
+            test_state["summary"] = summary; test_state["status"] = "finished"
+
+def run_local(params, plan, feeder=None):
+    # plan é um RequestTemplate (URL única) ou um Scenario; o modelo aberto envia requisições avulsas, sem sessão de usuário.
+    if params.get("load_model") == "open":
+        if isinstance(plan, Scenario):
+            with state_lock: test_state["error"] = "Scenarios require the closed load model (users)"
+        else: run_open_model(params, plan, feeder)
+    elif params.get("engine") == "asyncio":
+        raise_fd_limit(); asyncio.run(run_users_async(params, plan, feeder))
+    else: run_users_threaded(params, plan, feeder)
 
 def categorize_result(status_code):
     if status_code is None: return 'network_error'
@@ -91,18 +536,939 @@ def categorize_result(status_code):
     return 'other_error'
 
 def calculate_summary(results, duration):
-    total_reqs = len(results)
-    if total_reqs == 0: return {}
-    categorized_counts = Counter(categorize_result(r['status_code']) for r in results)
-    success_times = [r["duration"] for r in results if categorize_result(r['status_code']) == 'success']
-    summary = {"total_duration": f"{duration:.2f}", "total_requests": total_reqs, "rps": f"{total_reqs / duration:.2f}" if duration > 0 else "0.00",
-        "categorized_distribution": {"success": categorized_counts.get('success', 0), "rate_limit": categorized_counts.get('rate_limit', 0), "client_error": categorized_counts.get('client_error', 0), "server_error": categorized_counts.get('server_error', 0), "network_error": categorized_counts.get('network_error', 0),}}
-    if success_times:
-        success_times.sort()
-        summary.update({"avg_response_time": f"{sum(success_times) / len(success_times):.4f}", "min_response_time": f"{min(success_times):.4f}", "max_response_time": f"{max(success_times):.4f}", "p50_median": f"{success_times[int(len(success_times) * 0.50)]:.4f}", "p95": f"{success_times[int(len(success_times) * 0.95)]:.4f}", "p99": f"{success_times[int(len(success_times) * 0.99)]:.4f}",})
-    return summary
-
-# --- 2. ROTAS FLASK (Sem alterações) ---
+    aggregator = MetricsAggregator()
+    for result in results: aggregator.record(result)
+    return aggregator.summary(duration)
+
+# --- 1.2 MÉTRICAS EM STREAMING (memória fixa, atualização O(1) por requisição) ---
+# Histogramas log-lineares no estilo HDR: valores em microssegundos, 2^(HIST_SUB_BUCKET_BITS - 1) sub-buckets
+# por potência de 2, o que limita o erro relativo dos percentis a ~0.8% com algumas dezenas de KB por teste.
+
+CATEGORIES = ('success', 'rate_limit', 'client_error', 'server_error', 'network_error')
+HIST_SUB_BUCKET_BITS = 8
+HIST_MAX_VALUE_US = 1 << 36
+
+def histogram_index(value_us):
+    if value_us < (1 << HIST_SUB_BUCKET_BITS): return value_us
+    shift = value_us.bit_length() - HIST_SUB_BUCKET_BITS
+    return (shift << (HIST_SUB_BUCKET_BITS - 1)) + (value_us >> shift)
+
+def histogram_bucket_value(index):
+    if index < (1 << HIST_SUB_BUCKET_BITS): return index
+    shift = (index >> (HIST_SUB_BUCKET_BITS - 1)) - 1
+    mantissa = index - (shift << (HIST_SUB_BUCKET_BITS - 1))
+    return (mantissa << shift) + ((1 << shift) - 1) / 2
+
+HIST_SIZE = histogram_index(HIST_MAX_VALUE_US - 1) + 1
+
+class LatencyHistogram:
+    __slots__ = ("counts", "total", "sum", "min", "max")
+
+    def __init__(self):
+        self.counts, self.total, self.sum, self.min, self.max = [0] * HIST_SIZE, 0, 0.0, None, None
+
+    def record(self, seconds):
+        self.counts[histogram_index(min(max(int(seconds * 1e6), 0), HIST_MAX_VALUE_US - 1))] += 1
+        self.total += 1; self.sum += seconds
+        if self.min is None or seconds < self.min: self.min = seconds
+        if self.max is None or seconds > self.max: self.max = seconds
+
+    def merge(self, other):
+        if not other.total: return
+        counts = self.counts
+        for index, count in enumerate(other.counts):
+            if count: counts[index] += count
+        self.total += other.total; self.sum += other.sum
+        self.min = other.min if self.min is None else min(self.min, other.min)
+        self.max = other.max if self.max is None else max(self.max, other.max)
+
+    def export(self):
+        return {"buckets": {str(index): count for index, count in enumerate(self.counts) if count}, "sum": self.sum, "min": self.min, "max": self.max}
+
+    def merge_export(self, data, previous=None):
+        # Soma a diferença entre dois snapshots cumulativos (data - previous) vindos de um processo ou agente.
+        previous_buckets, counts, added = previous["buckets"] if previous else {}, self.counts, 0
+        for index, count in data["buckets"].items():
+            delta = count - previous_buckets.get(index, 0)
+            if delta: counts[int(index)] += delta; added += delta
+        if not added: return
+        self.total += added; self.sum += data["sum"] - (previous["sum"] if previous else 0.0)
+        self.min = data["min"] if self.min is None else min(self.min, data["min"])
+        self.max = data["max"] if self.max is None else max(self.max, data["max"])
+
+    def mean(self):
+        return self.sum / self.total if self.total else 0
+
+    def percentile(self, q):
+        # Mesmo critério de posição do cálculo original sobre a lista ordenada: o elemento de índice int(n * q).
+        if not self.total: return 0
+        rank, seen = min(int(self.total * q), self.total - 1), 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen > rank: return min(max(histogram_bucket_value(index) / 1e6, self.min), self.max)
+        return self.max
+
+class MetricsAggregator:
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.total, self.counts, self.histograms = 0, Counter(), {}
+        self.reuse_counts, self.reuse_success_counts, self.reuse_success_sums = Counter(), Counter(), Counter()
+        self.interval_counts, self.interval_histograms = Counter(), {}
+        self.schedule, self.interval_schedule, self.max_send_lag = Counter(), Counter(), 0.0
+        # Por etapa de cenário: contagem por categoria e histograma dos sucessos.
+        self.steps = {}
+        # Fases (dns/connect/tls/ttfb/body): histograma cumulativo por fase; no intervalo bastam soma e contagem para a média.
+        self.phases, self.bytes_received = {}, 0
+        self.interval_phase_sums, self.interval_phase_counts, self.interval_bytes = Counter(), Counter(), 0
+        # Amostras do GeneratorMonitor: somas (samples, saturated, cpu_sum) e máximos (*_max); a última amostra vai no export.
+        # shard_users guarda os usuários ativos da amostra mais recente de cada shard (somados no modo distribuído).
+        self.generator, self.interval_generator, self.generator_last, self.shard_users = Counter(), Counter(), {}, {}
+
+    def record(self, result):
+        category, duration = categorize_result(result["status_code"]), result["duration"]
+        self.total += 1; self.counts[category] += 1; self.interval_counts[category] += 1
+        histogram = self.histograms.get(category) or self.histograms.setdefault(category, LatencyHistogram())
+        histogram.record(duration)
+        histogram = self.interval_histograms.get(category) or self.interval_histograms.setdefault(category, LatencyHistogram())
+        histogram.record(duration)
+        reused = result.get("connection_reused")
+        if reused is not None:
+            self.reuse_counts[reused] += 1
+            if category == 'success': self.reuse_success_counts[reused] += 1; self.reuse_success_sums[reused] += duration
+        step = result.get("step")
+        if step is not None:
+            step_counts, step_histogram = self.steps.get(step) or self.steps.setdefault(step, (Counter(), LatencyHistogram()))
+            step_counts[category] += 1
+            if category == 'success': step_histogram.record(duration)
+        phases = result.get("phases")
+        if phases:
+            for phase, seconds in phases.items():
+                (self.phases.get(phase) or self.phases.setdefault(phase, LatencyHistogram())).record(seconds)
+                self.interval_phase_sums[phase] += seconds; self.interval_phase_counts[phase] += 1
+            received = result.get("bytes") or 0
+            self.bytes_received += received; self.interval_bytes += received
+
+    def record_schedule(self, counts, max_send_lag):
+        self.schedule.update(counts); self.interval_schedule.update(counts)
+        self.max_send_lag = max(self.max_send_lag, max_send_lag)
+
+    def record_generator(self, sample):
+        for stats in (self.generator, self.interval_generator):
+            stats["samples"] += 1; stats["saturated"] += sample["saturated"]; stats["cpu_sum"] += sample["cpu"]
+            for key in ("cpu", "lag", "drift", "users"):
+                if sample[key] > stats[key + "_max"]: stats[key + "_max"] = sample[key]
+        self.generator_last = sample
+
+    def take_interval(self):
+        transfer = {"phase_sums": self.interval_phase_sums, "phase_counts": self.interval_phase_counts, "bytes": self.interval_bytes}
+        interval = (self.interval_counts, self.interval_histograms, self.interval_schedule, transfer, self.interval_generator)
+        self.interval_counts, self.interval_histograms, self.interval_schedule = Counter(), {}, Counter()
+        self.interval_phase_sums, self.interval_phase_counts, self.interval_bytes, self.interval_generator = Counter(), Counter(), 0, Counter()
+        return interval
+
+    def live_stats(self):
+        return {"success": self.counts.get('success', 0), "errors": self.total - self.counts.get('success', 0), "total": self.total}
+
+    def export(self):
+        return {"total": self.total, "counts": dict(self.counts), "histograms": {category: histogram.export() for category, histogram in self.histograms.items()},
+            "reuse_counts": [self.reuse_counts[True], self.reuse_counts[False]], "reuse_success_counts": [self.reuse_success_counts[True], self.reuse_success_counts[False]],
+            "reuse_success_sums": [self.reuse_success_sums[True], self.reuse_success_sums[False]], "schedule": dict(self.schedule), "max_send_lag": self.max_send_lag,
+            "steps": {step: {"counts": dict(counts), "histogram": histogram.export()} for step, (counts, histogram) in self.steps.items()},
+            "phases": {phase: histogram.export() for phase, histogram in self.phases.items()}, "bytes_received": self.bytes_received,
+            "generator": dict(self.generator), "generator_last": self.generator_last}
+
+    def merge_export(self, data, previous=None, shard=None):
+        previous = previous or {}
+        self.total += data["total"] - previous.get("total", 0)
+        for category, count in data["counts"].items():
+            delta = count - previous.get("counts", {}).get(category, 0)
+            if delta: self.counts[category] += delta; self.interval_counts[category] += delta
+        for category, histogram in data["histograms"].items():
+            previous_histogram = previous.get("histograms", {}).get(category)
+            for histograms in (self.histograms, self.interval_histograms):
+                histograms.setdefault(category, LatencyHistogram()).merge_export(histogram, previous_histogram)
+        for key in ("reuse_counts", "reuse_success_counts", "reuse_success_sums"):
+            target, previous_values = getattr(self, key), previous.get(key, [0, 0])
+            for reused, value, previous_value in zip((True, False), data[key], previous_values): target[reused] += value - previous_value
+        previous_schedule = previous.get("schedule", {})
+        self.record_schedule({key: count - previous_schedule.get(key, 0) for key, count in data.get("schedule", {}).items() if count != previous_schedule.get(key, 0)}, data.get("max_send_lag", 0.0))
+        for step, step_data in data.get("steps", {}).items():
+            previous_step = previous.get("steps", {}).get(step, {})
+            step_counts, step_histogram = self.steps.get(step) or self.steps.setdefault(step, (Counter(), LatencyHistogram()))
+            step_counts.update({category: count - previous_step.get("counts", {}).get(category, 0) for category, count in step_data["counts"].items()})
+            step_histogram.merge_export(step_data["histogram"], previous_step.get("histogram"))
+        for phase, histogram_data in data.get("phases", {}).items():
+            histogram = self.phases.get(phase) or self.phases.setdefault(phase, LatencyHistogram())
+            total, seconds = histogram.total, histogram.sum
+            histogram.merge_export(histogram_data, previous.get("phases", {}).get(phase))
+            self.interval_phase_sums[phase] += histogram.sum - seconds; self.interval_phase_counts[phase] += histogram.total - total
+        received = data.get("bytes_received", 0) - previous.get("bytes_received", 0)
+        self.bytes_received += received; self.interval_bytes += received
+        # Gerador de cada shard: somas pela diferença; cpu, lag e drift são por processo (máximo entre shards, no intervalo
+        # pela amostra mais recente do shard), enquanto os usuários ativos são a soma das amostras mais recentes de cada shard.
+        generator, previous_generator = data.get("generator", {}), previous.get("generator", {})
+        if generator.get("samples", 0) != previous_generator.get("samples", 0):
+            for key in ("samples", "saturated", "cpu_sum"):
+                delta = generator.get(key, 0) - previous_generator.get(key, 0)
+                self.generator[key] += delta; self.interval_generator[key] += delta
+            for key in ("cpu", "lag", "drift"):
+                self.generator[key + "_max"] = max(self.generator[key + "_max"], generator.get(key + "_max", 0))
+                self.interval_generator[key + "_max"] = max(self.interval_generator[key + "_max"], data["generator_last"].get(key, 0))
+            self.shard_users[shard] = data["generator_last"].get("users", 0)
+            users = sum(self.shard_users.values())
+            self.generator["users_max"] = max(self.generator["users_max"], users); self.interval_generator["users_max"] = max(self.interval_generator["users_max"], users)
+
+    def summary(self, duration):
+        total_reqs = self.total
+        if total_reqs == 0 and not self.schedule: return {}
+        summary = {"total_duration": f"{duration:.2f}", "total_requests": total_reqs, "rps": f"{total_reqs / duration:.2f}" if duration > 0 else "0.00",
+            "categorized_distribution": {category: self.counts.get(category, 0) for category in CATEGORIES}}
+        reuse_avg = {reused: f"{self.reuse_success_sums[reused] / self.reuse_success_counts[reused]:.4f}" if self.reuse_success_counts[reused] else None for reused in (True, False)}
+        summary["connection_reuse"] = {"reused": self.reuse_counts.get(True, 0), "new": self.reuse_counts.get(False, 0), "avg_response_time_reused": reuse_avg[True], "avg_response_time_new": reuse_avg[False]}
+        if self.schedule:
+            summary["scheduler"] = {"intended": self.schedule["intended"], "sent": self.schedule["intended"] - self.schedule["dropped"], "dropped": self.schedule["dropped"], "late": self.schedule["late"],
+                "intended_rps": f"{self.schedule['intended'] / duration:.2f}" if duration > 0 else "0.00", "max_send_lag": f"{self.max_send_lag:.4f}"}
+        success = self.histograms.get('success')
+        if success:
+            summary.update({"avg_response_time": f"{success.mean():.4f}", "min_response_time": f"{success.min:.4f}", "max_response_time": f"{success.max:.4f}", "p50_median": f"{success.percentile(0.50):.4f}", "p95": f"{success.percentile(0.95):.4f}", "p99": f"{success.percentile(0.99):.4f}",})
+        if self.steps:
+            summary["steps"] = {step: {"total": sum(counts.values()), "success": counts.get('success', 0), "errors": sum(counts.values()) - counts.get('success', 0),
+                "avg_response_time": f"{histogram.mean():.4f}", "p50": f"{histogram.percentile(0.50):.4f}", "p95": f"{histogram.percentile(0.95):.4f}", "p99": f"{histogram.percentile(0.99):.4f}"}
+                for step, (counts, histogram) in self.steps.items()}
+        if self.phases:
+            summary["phases"] = {phase: {"count": histogram.total, "avg": f"{histogram.mean():.4f}", "p50": f"{histogram.percentile(0.50):.4f}", "p95": f"{histogram.percentile(0.95):.4f}", "p99": f"{histogram.percentile(0.99):.4f}", "max": f"{histogram.max:.4f}"}
+                for phase in PHASES if (histogram := self.phases.get(phase)) and histogram.total}
+            transfers = self.phases["body"].total if "body" in self.phases else 0
+            summary["transfer"] = {"bytes_received": self.bytes_received, "avg_bytes": f"{self.bytes_received / transfers:.0f}" if transfers else "0", "throughput": f"{self.bytes_received / duration:.0f}" if duration > 0 else "0"}
+        generator = self.generator
+        if generator["samples"]:
+            summary["generator"] = {"samples": generator["samples"], "saturated_samples": generator["saturated"], "saturated_pct": f"{generator['saturated'] / generator['samples'] * 100:.1f}",
+                "avg_cpu": f"{generator['cpu_sum'] / generator['samples']:.1f}", "max_cpu": f"{generator['cpu_max']:.1f}", "max_lag": f"{generator['lag_max']:.4f}",
+                "max_send_drift": f"{generator['drift_max']:.4f}", "max_users": generator["users_max"]}
+        return summary
+
+metrics = MetricsAggregator()
+
+# --- 1.3 GERAÇÃO DISTRIBUÍDA (processos locais e agentes remotos) ---
+# O controlador divide os usuários entre os shards intercalando o ramp-up (o usuário j do shard i parte em
+# (j * shards + i) * intervalo), coleta snapshots cumulativos das métricas a cada AGENT_REPORT_INTERVAL e soma
+# só a diferença no agregador global, de modo que data_aggregator e o resumo final funcionam sem alterações.
+# Um agente remoto é qualquer outra instância do LoadTester: as rotas /agent/* ficam sempre disponíveis.
+
+def local_processes(params):
+    try: return max(0, int(params.get("processes", 0) or 0))
+    except (ValueError, TypeError): return 0
+
+def agent_urls(params):
+    return [url.strip().rstrip("/") for url in str(params.get("agents", "") or "").replace(",", "\n").split("\n") if url.strip()]
+
+def is_distributed(params):
+    return local_processes(params) > 1 or bool(agent_urls(params))
+
+def shard_params(params, shards):
+    users, interval = params.get("users", 1), ramp_up_interval(params)
+    base, extra = divmod(users, shards)
+    open_model = params.get("load_model") == "open"
+    # No modelo aberto cada shard recebe a mesma fração da taxa-alvo em todos os estágios do perfil.
+    rate_share = {"rate_profile": ", ".join(f"{rps / shards:g}:{seconds:g}" for rps, seconds in rate_stages(params))} if open_model else {}
+    return [{**params, **rate_share, "users": count, "ramp_up": interval * shards * count, "ramp_offset": interval * index, "processes": 0, "agents": ""}
+        for index, count in enumerate(base + (1 if index < extra else 0) for index in range(shards))]
+
+def process_agent(params, report_queue, stop_signal, results_path=None):
+    # O processo filho (spawn) não herda app.config: o caminho do log vem por argumento, nunca pelos params do formulário.
+    if results_path: app.config["RESULTS_PATH"] = results_path
+    threading.Thread(target=lambda: (stop_signal.wait(), stop_event.set()), daemon=True).start()
+    runner = threading.Thread(target=run_load_test, args=(params,)); runner.start()
+    while True:
+        runner.join(AGENT_REPORT_INTERVAL)
+        finished = not runner.is_alive()
+        drain_results()
+        with state_lock: status = test_state["status"]
+        with metrics_lock: report_queue.put((status, metrics.export()))
+        if finished: break
+
+class LocalProcessShard:
+    def __init__(self, name, params, results_path=None):
+        context = multiprocessing.get_context("spawn")
+        self.name, self.status, self.snapshot, self.error, self.results_path = name, "starting", None, None, results_path
+        self.queue, self.stop_signal = context.Queue(), context.Event()
+        self.process = context.Process(target=process_agent, args=(params, self.queue, self.stop_signal, results_path), daemon=True)
+
+    def start(self):
+        self.process.start()
+
+    def poll(self):
+        alive = self.process.is_alive()
+        try:
+            while True: self.status, self.snapshot = self.queue.get_nowait()
+        except queue.Empty: pass
+        if not alive and self.status != "finished": self.status, self.error = "failed", f"exit code {self.process.exitcode}"
+        return self.snapshot
+
+    def stop(self):
+        self.stop_signal.set()
+
+class RemoteAgentShard:
+    def __init__(self, url, params):
+        self.name, self.params, self.status, self.snapshot, self.error, self.failures = url, params, "starting", None, None, 0
+
+    def start(self):
+        response = requests.post(f"{self.name}/agent/start", json=self.params, timeout=AGENT_HTTP_TIMEOUT)
+        if response.status_code != 202: raise requests.exceptions.RequestException(f"HTTP {response.status_code}: {response.text[:200]}")
+
+    def poll(self):
+        try:
+            data = requests.get(f"{self.name}/agent/metrics", timeout=AGENT_HTTP_TIMEOUT).json()
+            self.status, self.snapshot, self.failures = data["status"], data["metrics"], 0
+        except (requests.exceptions.RequestException, ValueError, KeyError) as e:
+            self.failures += 1; self.error = str(e)
+            if self.failures >= AGENT_MAX_FAILURES: self.status = "failed"
+        return self.snapshot
+
+    def stop(self):
+        try: requests.post(f"{self.name}/agent/stop", timeout=AGENT_HTTP_TIMEOUT)
+        except requests.exceptions.RequestException: pass
+
+def run_distributed(params):
+    processes, agents = local_processes(params), agent_urls(params)
+    # Um rate_profile inválido precisa ser reportado aqui: shard_params o divide entre os shards antes de qualquer um iniciar.
+    try: shards_params = shard_params(params, processes + len(agents))
+    except ValueError as e:
+        with state_lock: test_state["error"] = str(e)
+        return
+    # Com --results-dir, cada processo local grava results_<data>_<shard>.ltlog; os resultados brutos não voltam ao controlador.
+    stamp, results_dir = time.strftime("results_%Y%m%d_%H%M%S", time.localtime()), app.config.get("RESULTS_DIR")
+    shards = [LocalProcessShard(f"process-{index + 1}", shard, results_dir and os.path.join(results_dir, f"{stamp}_process-{index + 1}.ltlog")) for index, shard in enumerate(shards_params[:processes])]
+    shards += [RemoteAgentShard(url, shard) for url, shard in zip(agents, shards_params[processes:])]
+    with state_lock:
+        test_state["results_log"] = [shard.results_path for shard in shards[:processes]] if results_dir else None
+        if param_enabled(params, "keep_raw_results"): test_state["error"] = "keep_raw_results is not available in distributed mode: raw results stay in each shard (use --results-dir for per-shard logs)"
+    previous, stopping = [None] * len(shards), False
+    for shard in shards:
+        try: shard.start()
+        except (requests.exceptions.RequestException, OSError) as e: shard.status, shard.error = "failed", str(e)
+    while True:
+        time.sleep(AGENT_REPORT_INTERVAL)
+        if stop_event.is_set() and not stopping:
+            stopping = True
+            for shard in shards: shard.stop()
+        for index, shard in enumerate(shards):
+            if shard.status in ("finished", "failed"): continue
+            snapshot = shard.poll()
+            if snapshot is not None and snapshot is not previous[index]:
+                with metrics_lock: metrics.merge_export(snapshot, previous[index], shard=index)
+                previous[index] = snapshot
+        with state_lock:
+            test_state["agents"] = [{"name": shard.name, "status": shard.status, "error": shard.error} for shard in shards]
+            if test_state["status"] == "ramping" and all(shard.status not in ("starting", "idle", "ramping") for shard in shards): test_state["status"] = "running"
+        if all(shard.status in ("finished", "failed") for shard in shards): break
+
+# --- 1.4 MODELO ABERTO (taxa de chegada alvo, independente da latência do DUT) ---
+# Os instantes de envio são gerados como deslocamentos absolutos desde o início do teste, então o atraso de um envio
+# não se acumula nos seguintes (sem drift) e um único timer por deadline basta. A latência é medida a partir do
+# instante planejado (evita coordinated omission); envios acima de max_in_flight são descartados e contados.
+
+def rate_stages(params):
+    # rate_profile: "rps:segundos, rps:segundos, ..."; sem perfil, target_rps constante por duration segundos.
+    profile = str(params.get("rate_profile", "") or "").strip()
+    if not profile: return [(float(params.get("target_rps", 10)), float(params.get("duration", 60)))]
+    try: stages = [tuple(float(value) for value in stage.split(":", 1)) for stage in profile.replace(";", ",").split(",") if stage.strip()]
+    except ValueError: stages = []
+    if not stages or any(len(stage) != 2 or stage[0] < 0 or stage[1] <= 0 for stage in stages): raise ValueError(f"Invalid rate profile '{profile}'")
+    return stages
+
+def arrival_times(stages, shape="step", arrival="constant", rng=random):
+    # Cada chegada ocupa uma unidade na integral da taxa N(t) = r0*t + slope*t^2/2 do estágio (exponencial unitária no
+    # modo Poisson); o instante é a raiz de N(t) = u, o que vale tanto para degraus quanto para rampas lineares.
+    draw = (lambda: rng.expovariate(1.0)) if arrival == "poisson" else (lambda: 1.0)
+    elapsed, previous_rps, position = 0.0, 0.0, (draw() if arrival == "poisson" else 0.0)
+    for rps, seconds in stages:
+        start_rps = previous_rps if shape == "linear" else rps
+        half_slope = (rps - start_rps) / seconds / 2
+        total = start_rps * seconds + half_slope * seconds * seconds
+        while position < total:
+            yield elapsed + (2 * position / (start_rps + math.sqrt(start_rps * start_rps + 4 * half_slope * position)) if position else 0.0)
+            position += draw()
+        position -= total; elapsed += seconds; previous_rps = rps
+
+def max_in_flight(params):
+    try: return max(1, int(params.get("max_in_flight", DEFAULT_MAX_IN_FLIGHT)))
+    except (ValueError, TypeError): return DEFAULT_MAX_IN_FLIGHT
+
+class ScheduleTracker:
+    # Contadores locais do despachante, publicados no agregador em lote para não disputar metrics_lock a cada envio.
+    def __init__(self):
+        self.counts, self.max_send_lag, self.last_flush = Counter(), 0.0, time.perf_counter()
+
+    def sent(self, lag, dropped=False):
+        note_send_drift(lag)
+        self.counts["intended"] += 1
+        if dropped: self.counts["dropped"] += 1
+        if lag > SEND_LATE_THRESHOLD: self.counts["late"] += 1
+        if lag > self.max_send_lag: self.max_send_lag = lag
+        if time.perf_counter() - self.last_flush > SCHEDULE_FLUSH_INTERVAL: self.flush()
+
+    def flush(self):
+        with metrics_lock: metrics.record_schedule(self.counts, self.max_send_lag)
+        self.counts, self.last_flush = Counter(), time.perf_counter()
+
+def run_open_model(params, template, feeder=None):
+    try: arrivals = arrival_times(rate_stages(params), params.get("profile_shape", "step"), params.get("arrival", "constant"))
+    except ValueError as e:
+        with state_lock: test_state["error"] = str(e)
+        return
+    with state_lock: test_state["status"] = "running"
+    if params.get("engine") == "asyncio":
+        raise_fd_limit(); asyncio.run(run_arrivals_async(params, template, feeder, arrivals))
+    else: run_arrivals_threaded(params, template, feeder, arrivals)
+
+def run_arrivals_threaded(params, template, feeder, arrivals):
+    tracker, limit = ScheduleTracker(), max_in_flight(params)
+    slots = threading.BoundedSemaphore(limit)
+    session = create_session(min(limit, pool_size(params))) if connection_mode(params) != "new" else None
+    # Usuários ativos no modelo aberto = requisições em voo (vagas ocupadas do semáforo).
+    track_users(lambda: limit - slots._value)
+    def send(scheduled_at):
+        try: record_result(worker(template, session, scheduled_at, next_variables(feeder)))
+        finally: slots.release()
+    with ThreadPoolExecutor(max_workers=limit) as executor:
+        start = time.perf_counter()
+        for offset in arrivals:
+            if stop_event.is_set(): break
+            delay = start + offset - time.perf_counter()
+            if delay > 0: time.sleep(delay)
+            lag = time.perf_counter() - start - offset
+            if not slots.acquire(blocking=False): tracker.sent(lag, dropped=True); continue
+            tracker.sent(lag); executor.submit(send, start + offset)
+    tracker.flush()
+    if session: session.close()
+
+async def run_arrivals_async(params, template, feeder, arrivals):
+    tracker, limit, in_flight = ScheduleTracker(), max_in_flight(params), set()
+    ssl_context = ssl.create_default_context()
+    pool = AsyncConnectionPool(min(limit, pool_size(params)), ssl_context) if connection_mode(params) != "new" else None
+    async def send(scheduled_at):
+        record_result(await async_worker(template, ssl_context, pool, scheduled_at, next_variables(feeder)))
+    track_users(lambda: len(in_flight)); probe = asyncio.ensure_future(loop_lag_probe())
+    loop = asyncio.get_running_loop()
+    start, perf_start = loop.time(), time.perf_counter()
+    for offset in arrivals:
+        if stop_event.is_set(): break
+        delay = start + offset - loop.time()
+        await asyncio.sleep(max(0, delay))
+        lag = loop.time() - start - offset
+        if len(in_flight) >= limit: tracker.sent(lag, dropped=True); continue
+        tracker.sent(lag)
+        task = asyncio.ensure_future(send(perf_start + offset)); in_flight.add(task); task.add_done_callback(in_flight.discard)
+    tracker.flush()
+    await asyncio.gather(*in_flight)
+    probe.cancel()
+    if pool: pool.close()
+
+# --- 1.5 LOG BINÁRIO DE RESULTADOS (gravação em lote em segundo plano + replay offline) ---
+# Arquivo .ltlog: cabeçalho (magic, início do teste) seguido de registros de largura fixa com instante de término,
+# duração, status HTTP (0 = sem resposta), categoria, flags de reuso de conexão e id do erro. As mensagens de erro ficam
+# internadas em <arquivo>.errors (uma string JSON por linha, id = número da linha). Registros de largura fixa permitem
+# mapear o arquivo em memória e recalcular resumo e série temporal de qualquer janela sem carregar o teste inteiro.
+
+RESULTS_LOG_MAGIC = b"LTRLOG1\n"
+RESULTS_LOG_HEADER = struct.Struct("<8sd")
+RESULTS_LOG_RECORD = struct.Struct("<dfHBBI")
+LOG_CATEGORIES = CATEGORIES + ('other_error',)
+LOG_FLAG_REUSE_KNOWN, LOG_FLAG_REUSED = 1, 2
+REPLAY_CHUNK_RECORDS = 1 << 22
+
+class ResultsLogWriter:
+    def __init__(self, path, start_time):
+        self.path, self.pending, self.error_ids, self.closed = path, deque(), {}, threading.Event()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.file, self.errors_file = open(path, "wb"), open(path + ".errors", "w", encoding="utf-8")
+        self.file.write(RESULTS_LOG_HEADER.pack(RESULTS_LOG_MAGIC, start_time))
+        self.thread = threading.Thread(target=self.run, daemon=True); self.thread.start()
+
+    def append(self, batch):
+        self.pending.append(batch)
+
+    def run(self):
+        while not self.closed.wait(RESULTS_LOG_FLUSH_INTERVAL): self.flush()
+        self.flush()
+
+    def flush(self):
+        chunks = []
+        try:
+            while True: chunks.append(self.pack(self.pending.popleft()))
+        except IndexError: pass
+        if not chunks: return
+        # A tabela de erros vai para o disco antes dos registros que a referenciam.
+        self.errors_file.flush(); self.file.write(b"".join(chunks)); self.file.flush()
+
+    def pack(self, batch):
+        buffer, pack_into, size = bytearray(len(batch) * RESULTS_LOG_RECORD.size), RESULTS_LOG_RECORD.pack_into, RESULTS_LOG_RECORD.size
+        for offset, result in zip(range(0, len(buffer), size), batch):
+            reused = result.get("connection_reused")
+            flags = 0 if reused is None else LOG_FLAG_REUSE_KNOWN | (LOG_FLAG_REUSED if reused else 0)
+            pack_into(buffer, offset, result.get("timestamp", 0.0), result["duration"], result["status_code"] or 0, LOG_CATEGORIES.index(categorize_result(result["status_code"])), flags, self.error_id(result["error"]))
+        return buffer
+
+    def error_id(self, error):
+        if not error: return 0
+        error_id = self.error_ids.get(error)
+        if error_id is None:
+            error_id = self.error_ids[error] = len(self.error_ids) + 1
+            self.errors_file.write(json.dumps(error) + "\n")
+        return error_id
+
+    def close(self):
+        self.closed.set(); self.thread.join()
+        self.file.close(); self.errors_file.close()
+
+def read_log_errors(path):
+    try:
+        with open(path + ".errors", encoding="utf-8") as errors_file: return [None] + [json.loads(line) for line in errors_file if line.strip()]
+    except FileNotFoundError: return [None]
+
+def replay_results_log(path, window_start=None, window_end=None, interval=10.0):
+    # Recalcula resumo, série temporal e contagem de erros de uma janela [window_start, window_end) em segundos desde o
+    # início do teste. Com numpy o arquivo é mapeado e processado em blocos vetorizados; sem numpy, registro a registro.
+    with open(path, "rb") as log_file:
+        magic, start_time = RESULTS_LOG_HEADER.unpack(log_file.read(RESULTS_LOG_HEADER.size))
+        if magic != RESULTS_LOG_MAGIC: raise ValueError(f"{path} is not a LoadTester results log")
+        records = (os.fstat(log_file.fileno()).st_size - RESULTS_LOG_HEADER.size) // RESULTS_LOG_RECORD.size
+        lower = start_time + (window_start or 0)
+        upper = start_time + window_end if window_end is not None else float("inf")
+        replay = replay_numpy if numpy is not None else replay_python
+        aggregator, points, error_counts, last_timestamp = replay(log_file, records, lower, upper, interval)
+    errors = read_log_errors(path)
+    duration = max(0.0, min(upper, last_timestamp) - lower) if aggregator.total else 0.0
+    return {"start_time": start_time, "records": records, "summary": aggregator.summary(duration), "time_series_data": points,
+        "errors": {errors[error_id] if error_id < len(errors) else f"error #{error_id}": count for error_id, count in error_counts.most_common()}}
+
+def iter_log_records(log_file, records):
+    with mmap.mmap(log_file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        for chunk_start in range(0, records, REPLAY_CHUNK_RECORDS):
+            offset = RESULTS_LOG_HEADER.size + chunk_start * RESULTS_LOG_RECORD.size
+            yield from RESULTS_LOG_RECORD.iter_unpack(mapped[offset:offset + min(REPLAY_CHUNK_RECORDS, records - chunk_start) * RESULTS_LOG_RECORD.size])
+
+def replay_python(log_file, records, lower, upper, interval):
+    aggregator, bins, error_counts, last_timestamp = MetricsAggregator(), {}, Counter(), lower
+    if not records: return aggregator, [], error_counts, last_timestamp
+    for timestamp, duration, status, category, flags, error_id in iter_log_records(log_file, records):
+        if not lower <= timestamp < upper: continue
+        aggregator.record({"status_code": status or None, "duration": duration, "connection_reused": bool(flags & LOG_FLAG_REUSED) if flags & LOG_FLAG_REUSE_KNOWN else None})
+        last_timestamp = max(last_timestamp, timestamp)
+        if error_id: error_counts[error_id] += 1
+        counts, success = bins.setdefault(int((timestamp - lower) // interval), (Counter(), LatencyHistogram()))
+        counts[LOG_CATEGORIES[category]] += 1
+        if LOG_CATEGORIES[category] == 'success': success.record(duration)
+    points = [interval_point(lower + (index + 1) * interval, interval, counts, success.mean(), *(success.percentile(q) for q in (0.50, 0.95, 0.99))) for index, (counts, success) in sorted(bins.items())]
+    return aggregator, points, error_counts, last_timestamp
+
+def replay_numpy(log_file, records, lower, upper, interval):
+    aggregator, error_counts, last_timestamp = MetricsAggregator(), Counter(), lower
+    if not records: return aggregator, [], error_counts, last_timestamp
+    dtype = numpy.dtype([("timestamp", "<f8"), ("duration", "<f4"), ("status", "<u2"), ("category", "u1"), ("flags", "u1"), ("error_id", "<u4")])
+    data = numpy.memmap(log_file, dtype=dtype, mode="r", offset=RESULTS_LOG_HEADER.size, shape=(records,))
+    categories = len(LOG_CATEGORIES)
+    histogram_counts, sums = numpy.zeros(categories * HIST_SIZE, dtype=numpy.int64), numpy.zeros(categories)
+    minimums, maximums = numpy.full(categories, numpy.inf), numpy.full(categories, -numpy.inf)
+    reuse = {key: numpy.zeros(2) for key in ("counts", "success_counts", "success_sums")}
+    bin_counts, bin_success, bin_sums, bin_keys = Counter(), Counter(), Counter(), []
+    for chunk_start in range(0, records, REPLAY_CHUNK_RECORDS):
+        chunk = data[chunk_start:chunk_start + REPLAY_CHUNK_RECORDS]
+        chunk = chunk[(chunk["timestamp"] >= lower) & (chunk["timestamp"] < upper)]
+        if not len(chunk): continue
+        category, duration, flags = chunk["category"].astype(numpy.int64), chunk["duration"].astype(numpy.float64), chunk["flags"]
+        last_timestamp = max(last_timestamp, float(chunk["timestamp"].max()))
+        # Mesmo índice de bucket de histogram_index(), vetorizado: frexp devolve o bit_length exato de inteiros < 2^53.
+        values = numpy.clip((duration * 1e6).astype(numpy.int64), 0, HIST_MAX_VALUE_US - 1)
+        shift = numpy.maximum(numpy.frexp(values.astype(numpy.float64))[1] - HIST_SUB_BUCKET_BITS, 0)
+        buckets = numpy.where(values < (1 << HIST_SUB_BUCKET_BITS), values, (shift << (HIST_SUB_BUCKET_BITS - 1)) + (values >> shift))
+        histogram_counts += numpy.bincount(category * HIST_SIZE + buckets, minlength=categories * HIST_SIZE)
+        sums += numpy.bincount(category, weights=duration, minlength=categories)
+        numpy.minimum.at(minimums, category, duration); numpy.maximum.at(maximums, category, duration)
+        known, success = (flags & LOG_FLAG_REUSE_KNOWN) > 0, category == LOG_CATEGORIES.index('success')
+        reused_index = numpy.where(flags & LOG_FLAG_REUSED, 0, 1)
+        reuse["counts"] += numpy.bincount(reused_index[known], minlength=2)
+        reuse["success_counts"] += numpy.bincount(reused_index[known & success], minlength=2)
+        reuse["success_sums"] += numpy.bincount(reused_index[known & success], weights=duration[known & success], minlength=2)
+        error_ids, error_totals = numpy.unique(chunk["error_id"][chunk["error_id"] > 0], return_counts=True)
+        error_counts.update(dict(zip(error_ids.tolist(), error_totals.tolist())))
+        bins = ((chunk["timestamp"] - lower) // interval).astype(numpy.int64)
+        keys, totals = numpy.unique(bins * categories + category, return_counts=True); bin_counts.update(dict(zip(keys.tolist(), totals.tolist())))
+        keys, totals = numpy.unique(bins[success] * HIST_SIZE + buckets[success], return_counts=True); bin_success.update(dict(zip(keys.tolist(), totals.tolist())))
+        keys, inverse = numpy.unique(bins[success], return_inverse=True); bin_sums.update(dict(zip(keys.tolist(), numpy.bincount(inverse, weights=duration[success]).tolist())))
+        bin_keys.append(numpy.unique(bins))
+    for index, name in enumerate(LOG_CATEGORIES):
+        counts = histogram_counts[index * HIST_SIZE:(index + 1) * HIST_SIZE]
+        total = int(counts.sum())
+        if not total: continue
+        histogram = aggregator.histograms[name] = LatencyHistogram()
+        histogram.counts, histogram.total, histogram.sum, histogram.min, histogram.max = counts.tolist(), total, float(sums[index]), float(minimums[index]), float(maximums[index])
+        aggregator.counts[name] = total; aggregator.total += total
+    for reused, position in ((True, 0), (False, 1)):
+        aggregator.reuse_counts[reused], aggregator.reuse_success_counts[reused] = int(reuse["counts"][position]), int(reuse["success_counts"][position])
+        aggregator.reuse_success_sums[reused] = float(reuse["success_sums"][position])
+    return aggregator, replay_numpy_points(numpy.unique(numpy.concatenate(bin_keys)) if bin_keys else [], bin_counts, bin_success, bin_sums, lower, interval), error_counts, last_timestamp
+
+def replay_numpy_points(bins, bin_counts, bin_success, bin_sums, lower, interval):
+    # Percentis por intervalo a partir dos buckets esparsos (bin, bucket): uma soma acumulada global ordenada por chave
+    # permite localizar o bucket de cada posição com um único searchsorted por percentil.
+    keys = numpy.array(sorted(bin_success), dtype=numpy.int64)
+    counts = numpy.array([bin_success[key] for key in keys.tolist()], dtype=numpy.int64)
+    cumulative, owners = numpy.cumsum(counts), keys // HIST_SIZE
+    # histogram_bucket_value() vetorizado.
+    indexes = keys % HIST_SIZE
+    shift = numpy.maximum((indexes >> (HIST_SUB_BUCKET_BITS - 1)) - 1, 0)
+    values = numpy.where(indexes < (1 << HIST_SUB_BUCKET_BITS), indexes, ((indexes - (shift << (HIST_SUB_BUCKET_BITS - 1))) << shift) + ((1 << shift) - 1) / 2) / 1e6
+    points = []
+    for index in (bins.tolist() if len(bins) else []):
+        counts_by_category = {name: bin_counts.get(index * len(LOG_CATEGORIES) + position, 0) for position, name in enumerate(LOG_CATEGORIES)}
+        first, last = numpy.searchsorted(owners, index), numpy.searchsorted(owners, index, side="right")
+        before, total = (int(cumulative[first - 1]) if first else 0), int(cumulative[last - 1] - (cumulative[first - 1] if first else 0)) if last > first else 0
+        stats = [0.0] * 4
+        if total:
+            stats[0] = bin_sums[index] / total
+            stats[1:] = [float(values[numpy.searchsorted(cumulative, before + min(int(total * q), total - 1), side="right")]) for q in (0.50, 0.95, 0.99)]
+        points.append(interval_point(lower + (index + 1) * interval, interval, counts_by_category, *stats))
+    return points
+
+# --- 1.6 STREAMING DE STATUS (payloads SSE pré-serializados e compartilhados entre clientes) ---
+
+class StatusStream:
+    def __init__(self):
+        self.lock, self.generation = threading.Lock(), 0
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.events, self.snapshot_payload, self.snapshot_status, self.snapshot_time, self.summary_payload = [], "", "idle", 0.0, None
+            self.generation += 1
+
+    def publish_interval(self, point):
+        with self.lock: self.events.append(f"id: {len(self.events)}\nevent: interval\ndata: {json.dumps(point)}\n\n")
+
+    def events_since(self, cursor):
+        with self.lock: return self.events[cursor:]
+
+    def snapshot(self, max_age):
+        # O snapshot de contadores é reconstruído no máximo uma vez por max_age, não uma vez por cliente.
+        with self.lock:
+            if time.monotonic() - self.snapshot_time < max_age: return self.snapshot_status, self.snapshot_payload
+        with metrics_lock: live_stats = metrics.live_stats()
+        with state_lock:
+            params, status = test_state["params"], test_state["status"]
+            counters = {"status": status, "live_stats": live_stats, "agents": test_state.get("agents"), "error": test_state.get("error"),
+                "target": "-" if params.get("load_model") == "open" or params.get("scenario") else params.get("users", 0) * params.get("reqs_per_user", 0)}
+        payload = f"event: counters\ndata: {json.dumps(counters)}\n\n"
+        with self.lock: self.snapshot_status, self.snapshot_payload, self.snapshot_time = status, payload, time.monotonic()
+        return status, payload
+
+    def summary_event(self):
+        # Nunca segurar self.lock e state_lock juntos: begin_test chama reset() com state_lock já adquirido.
+        # Se um novo teste começou no meio (generation mudou), o resumo lido pertence ao anterior e não é guardado.
+        with self.lock:
+            if self.summary_payload is not None: return self.summary_payload
+            generation = self.generation
+        with state_lock: payload = f"event: summary\ndata: {json.dumps(test_state['summary'])}\n\n"
+        with self.lock:
+            if self.summary_payload is None and self.generation == generation: self.summary_payload = payload
+            return self.summary_payload or payload
+
+status_stream = StatusStream()
+
+# --- 1.7 TEMPLATES DE REQUISIÇÃO (compilados uma vez por teste, bytes prontos no caminho quente) ---
+# Método, URL, cabeçalhos e corpo são validados e codificados uma única vez no início do teste: sem placeholders, cada
+# requisição reaproveita a PreparedRequest (threads) ou os bytes completos da requisição (asyncio). Placeholders
+# {{nome}} viram segmentos pré-divididos preenchidos a partir de uma linha do data_file (JSONL, um objeto por linha).
+
+PLACEHOLDER_PATTERN = re.compile(r"\{\{\s*([A-Za-z_][\w.-]*)\s*\}\}")
+
+def compile_placeholders(text, encode):
+    parts = PLACEHOLDER_PATTERN.split(text)
+    if len(parts) == 1: return None
+    literals, names = parts[0::2], parts[1::2]
+    def render(variables):
+        rendered = [literals[0]]
+        for name, literal in zip(names, literals[1:]):
+            value = variables.get(name)
+            rendered.append("{{" + name + "}}" if value is None else encode(value)); rendered.append(literal)
+        return "".join(rendered)
+    return render
+
+def json_fragment(value):
+    # Strings entram já escapadas para ficar entre aspas no corpo ("{{nome}}"); números e booleanos entram como literais JSON.
+    return json.dumps(value)[1:-1] if isinstance(value, str) else json.dumps(value)
+
+def parse_headers(text):
+    try: return {k.strip(): v.strip() for line in str(text or "").strip().split("\n") if ":" in line for k, v in [line.split(":", 1)]}
+    except Exception: return {}
+
+class RequestTemplate:
+    def __init__(self, method, url, headers, body):
+        self.method, self.url, self.headers, self.body_bytes, self.error = method, url, headers, None, None
+        self.url_render = compile_placeholders(url, lambda value: quote(str(value), safe=""))
+        self.header_renders = {k: render for k, v in headers.items() if (render := compile_placeholders(v, str))}
+        self.body_render = compile_placeholders(body, json_fragment) if body else None
+        # Corpo com placeholders é enviado como texto renderizado (o JSON só é válido depois da substituição).
+        if body and not self.body_render:
+            try: self.body_bytes = json.dumps(json.loads(body)).encode()
+            except json.JSONDecodeError as e: self.error = f"JSON Body Error: {e}"
+        self.static = not (self.url_render or self.header_renders or self.body_render)
+        self.prepared, self.payloads, self.settings = None, {}, {}
+
+    @classmethod
+    def from_params(cls, params):
+        # start_test converte valores numéricos do formulário: um corpo JSON como 123 chega aqui como int.
+        return cls(str(params.get("method") or "GET"), str(params.get("url", "")), parse_headers(params.get("headers", "")), str(params.get("body") or ""))
+
+    def render(self, variables):
+        if self.static or variables is None: variables = {}
+        url = self.url_render(variables) if self.url_render else self.url
+        headers = {**self.headers, **{k: render(variables) for k, render in self.header_renders.items()}} if self.header_renders else self.headers
+        body = self.body_render(variables).encode() if self.body_render else self.body_bytes
+        return url, headers, body
+
+    def prepare(self, variables=None):
+        # A PreparedRequest estática é compartilhada entre usuários: Session.send só a lê.
+        if self.static and self.prepared is not None: return self.prepared
+        url, headers, body = self.render(variables)
+        request_headers = requests.utils.default_headers()
+        if body is not None: request_headers["Content-Type"] = "application/json"
+        request_headers.update(headers)
+        prepared = requests.Request(self.method, url, headers=request_headers, data=body).prepare(), self.environment_settings(url)
+        if self.static: self.prepared = prepared
+        return prepared
+
+    def environment_settings(self, url):
+        # Proxies e CA bundle do ambiente, que Session.request resolve varrendo os.environ a cada chamada; dependem só do host.
+        netloc = urlsplit(url).netloc
+        settings = self.settings.get(netloc)
+        if settings is None:
+            settings = self.settings[netloc] = {"proxies": requests.utils.get_environ_proxies(url), "verify": os.environ.get("REQUESTS_CA_BUNDLE") or os.environ.get("CURL_CA_BUNDLE") or True}
+        return settings
+
+    def payload(self, variables=None, keep_alive=False):
+        if self.static and keep_alive in self.payloads: return self.payloads[keep_alive]
+        payload = request_payload(self.method, *self.render(variables), keep_alive)
+        if self.static: self.payloads[keep_alive] = payload
+        return payload
+
+def request_payload(method, url, headers, body, keep_alive=False):
+    parts = urlsplit(url)
+    if parts.scheme not in ("http", "https") or not parts.hostname: raise ValueError(f"Invalid URL '{url}': No scheme or host supplied")
+    secure = parts.scheme == "https"
+    return (parts.hostname, parts.port or (443 if secure else 80), secure), build_request(method, parts, headers, body, keep_alive)
+
+class DataFeeder:
+    # Cada requisição consome a próxima linha (circular); next() em itertools.count é atômico sob o GIL.
+    def __init__(self, path):
+        with open(path, encoding="utf-8") as data_file: rows = [json.loads(line) for line in data_file if line.strip()]
+        if not rows: raise ValueError(f"Data file '{path}' has no rows")
+        self.rows, self.counter = [row if isinstance(row, dict) else {"value": row} for row in rows], itertools.count()
+
+    @classmethod
+    def from_params(cls, params):
+        path = str(params.get("data_file", "") or "").strip()
+        if not path: return None
+        try: return cls(path)
+        except (OSError, ValueError) as e: raise ValueError(f"Data file error: {e}") from e
+
+    def next(self):
+        return self.rows[next(self.counter) % len(self.rows)]
+
+def next_variables(feeder):
+    return feeder.next() if feeder else None
+
+# --- 1.8 CENÁRIOS MULTI-ETAPA (fluxos por usuário virtual com mistura ponderada e extração de variáveis) ---
+# Um cenário JSON descreve o que cada usuário faz: etapas com "once" rodam uma vez no início (ex.: login) e, a cada
+# iteração (reqs_per_user), uma entrada da mistura é sorteada por "weight" (bisect sobre pesos acumulados). Uma entrada é
+# uma etapa ou um grupo {"steps": [...]} executado em sequência, e "repeat" a repete. "extract" copia valores da resposta
+# (caminho JSON "$.a.b[0]" ou "re:padrão") para as variáveis do usuário, usadas nos {{nome}} das etapas seguintes.
+# Tudo é compilado no início do teste; no caminho quente sobram o sorteio e, só nas etapas com extract, a leitura do corpo.
+
+JSON_PATH_TOKEN = re.compile(r"\.([^.\[\]]+)|\[(\d+)\]")
+
+def compile_extractor(expression):
+    # Devolve (função(corpo, documento JSON) -> valor ou None, precisa do documento JSON).
+    if expression.startswith("re:"):
+        pattern = re.compile(expression[3:].encode())
+        def extract_match(body, document):
+            match = pattern.search(body)
+            return match and (match.group(1) if pattern.groups else match.group(0)).decode("utf-8", "replace")
+        return extract_match, False
+    if not expression.startswith("$") or JSON_PATH_TOKEN.sub("", expression[1:]): raise ValueError(f"Invalid extractor '{expression}' (use $.path[0].key or re:pattern)")
+    path = [int(index) if index else key for key, index in JSON_PATH_TOKEN.findall(expression[1:])]
+    def extract_path(body, document):
+        value = document
+        for token in path:
+            try: value = value[token]
+            except (KeyError, IndexError, TypeError): return None
+        return value
+    return extract_path, True
+
+class ScenarioStep:
+    def __init__(self, spec, base_url, name):
+        if not isinstance(spec, dict): raise ValueError(f"Step '{name}' must be an object")
+        self.name = str(spec.get("name") or name)
+        url, headers, body = str(spec.get("url", "")), spec.get("headers") or {}, spec.get("body")
+        headers = parse_headers(headers) if isinstance(headers, str) else {str(k): str(v) for k, v in headers.items()}
+        self.template = RequestTemplate(str(spec.get("method", "GET")).upper(), base_url + url if url.startswith("/") else url, headers, body if body is None or isinstance(body, str) else json.dumps(body))
+        if self.template.error: raise ValueError(f"Step '{self.name}': {self.template.error}")
+        self.extractors = [(str(variable), *compile_extractor(str(expression))) for variable, expression in (spec.get("extract") or {}).items()]
+        self.needs_document = any(needs_document for _, _, needs_document in self.extractors)
+        think_time = spec.get("think_time")
+        if isinstance(think_time, (list, tuple)): think_time = tuple(float(value) for value in think_time[:2])
+        elif think_time is not None: think_time = float(think_time)
+        self.think_time = think_time
+
+    def extract(self, body):
+        document = None
+        if self.needs_document:
+            try: document = json.loads(body)
+            except ValueError: pass
+        return {variable: value for variable, extractor, _ in self.extractors if (value := extractor(body, document)) is not None}
+
+    def think(self, params):
+        # Sem think_time na etapa vale o intervalo global do formulário, como no teste de URL única.
+        if self.think_time is None: return next_delay(params)
+        return random.uniform(*self.think_time) if isinstance(self.think_time, tuple) else self.think_time
+
+class Scenario:
+    def __init__(self, spec, base_url):
+        if isinstance(spec, list): spec = {"steps": spec}
+        if not isinstance(spec, dict) or not isinstance(spec.get("steps"), list) or not spec["steps"]: raise ValueError("Scenario needs a non-empty 'steps' list")
+        self.variables, self.setup, self.mix, weights = dict(spec.get("variables") or {}), [], [], []
+        base_url = str(spec.get("base_url") or base_url).rstrip("/")
+        for position, entry in enumerate(spec["steps"]):
+            sequence = self.compile_entry(entry, base_url, f"step_{position + 1}")
+            if isinstance(entry, dict) and entry.get("once"): self.setup.extend(sequence)
+            else: self.mix.append(sequence); weights.append(float(entry.get("weight", 1)) if isinstance(entry, dict) else 1.0)
+        if any(weight < 0 for weight in weights) or (weights and sum(weights) <= 0): raise ValueError("Scenario weights must be non-negative with a positive total")
+        self.cumulative_weights = list(itertools.accumulate(weights))
+
+    def compile_entry(self, entry, base_url, name):
+        if isinstance(entry, dict) and "steps" in entry:
+            group_name = str(entry.get("name") or name)
+            sequence = [step for position, child in enumerate(entry["steps"]) for step in self.compile_entry(child, base_url, f"{group_name}.{position + 1}")]
+        else: sequence = [ScenarioStep(entry, base_url, name)]
+        return tuple(sequence) * max(1, int(entry.get("repeat", 1)) if isinstance(entry, dict) else 1)
+
+    @classmethod
+    def from_params(cls, params):
+        text = str(params.get("scenario", "") or "").strip()
+        if not text: return None
+        parts = urlsplit(str(params.get("url", "")))
+        try: return cls(json.loads(text), f"{parts.scheme}://{parts.netloc}" if parts.scheme and parts.netloc else "")
+        except (ValueError, TypeError, AttributeError, re.error) as e: raise ValueError(f"Scenario error: {e}") from e
+
+    def user_variables(self, feeder=None):
+        # Cada usuário virtual começa com as variáveis do cenário mais uma linha do data_file.
+        return {**self.variables, **(feeder.next() if feeder else {})}
+
+    def iterations(self, count):
+        if self.setup: yield self.setup
+        if not self.mix: return
+        mix, cumulative, total, draw = self.mix, self.cumulative_weights, self.cumulative_weights[-1], random.random
+        for _ in range(count):
+            yield mix[0] if len(mix) == 1 else mix[bisect.bisect_right(cumulative, draw() * total)]
+
+# --- 1.9 AUTO-MONITORAMENTO DO GERADOR (detecta quando o gargalo é o próprio LoadTester) ---
+# A cada MONITOR_INTERVAL uma thread amostra o processo gerador: CPU (process_time sobre o tempo de parede, em % de um
+# núcleo, o teto prático de um processo Python por causa do GIL), atraso do próprio sleep da thread (contenção de GIL e
+# escalonador) ou do event loop (sonda asyncio), maior atraso de envio (sleeps dos usuários, ramp-up e despachante do
+# modelo aberto) e usuários ativos. Uma amostra é saturada se a CPU passa de MONITOR_CPU_SATURATION ou algum atraso passa
+# de MONITOR_LAG_SATURATION: nesses intervalos a latência medida inclui a fila do próprio gerador, não só a do DUT.
+# Com auto_tune (modelo fechado), o ramp-up espera a saturação passar e, se ela persistir por AUTO_TUNE_STREAK amostras,
+# uma fração dos usuários ativos encerra e o ramp-up para de iniciar novos.
+
+class GeneratorMonitor:
+    def __init__(self, params):
+        self.auto_tune = param_enabled(params, "auto_tune")
+        self.users_source, self.loop_lag, self.send_drift, self.saturated, self.streak = None, 0.0, 0.0, False, 0
+        self.retire_requests, self.retired, self.capped, self.ramp_paused = 0, 0, False, 0.0
+        self.lock, self.stopped = threading.Lock(), threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stopped.set(); self.thread.join()
+
+    def run(self):
+        last_wall, last_cpu = time.perf_counter(), time.process_time()
+        while not self.stopped.wait(MONITOR_INTERVAL):
+            now, cpu = time.perf_counter(), time.process_time()
+            wall = now - last_wall
+            sample = {"cpu": (cpu - last_cpu) / wall * 100, "lag": max(wall - MONITOR_INTERVAL, self.loop_lag, 0.0), "drift": max(self.send_drift, 0.0), "users": self.active_users()}
+            last_wall, last_cpu, self.loop_lag, self.send_drift = now, cpu, 0.0, 0.0
+            sample["saturated"] = self.saturated = sample["cpu"] >= MONITOR_CPU_SATURATION or max(sample["lag"], sample["drift"]) >= MONITOR_LAG_SATURATION
+            with metrics_lock: metrics.record_generator(sample)
+            self.streak = self.streak + 1 if self.saturated else 0
+            if self.auto_tune and self.streak >= AUTO_TUNE_STREAK and sample["users"]:
+                with self.lock: self.retire_requests, self.capped = max(1, int(sample["users"] * AUTO_TUNE_RETIRE_FRACTION)), True
+                self.streak = 0
+
+    def active_users(self):
+        try: return self.users_source() if self.users_source else 0
+        except RuntimeError: return 0
+
+    def retire(self):
+        with self.lock:
+            if not self.retire_requests: return False
+            self.retire_requests -= 1; self.retired += 1
+            return True
+
+    def ramp_wait(self):
+        # Tempo que o ramp-up ainda deve esperar antes do próximo usuário (None = não iniciar mais usuários).
+        if not self.auto_tune: return 0
+        if self.capped: return None
+        return MONITOR_INTERVAL if self.saturated else 0
+
+def track_users(source):
+    monitor = generator_monitor
+    if monitor: monitor.users_source = source
+
+def note_send_drift(drift):
+    # Máximo aproximado entre threads (sem lock): perder um máximo concorrente só atrasa a detecção em uma amostra.
+    monitor = generator_monitor
+    if monitor and drift > monitor.send_drift: monitor.send_drift = drift
+
+def retire_user():
+    monitor = generator_monitor
+    return bool(monitor and monitor.retire_requests and monitor.retire())
+
+def pause(seconds):
+    started = time.perf_counter(); time.sleep(seconds)
+    note_send_drift(time.perf_counter() - started - seconds)
+
+async def async_pause(seconds):
+    started = time.perf_counter(); await asyncio.sleep(seconds)
+    note_send_drift(time.perf_counter() - started - seconds)
+
+def hold_ramp():
+    monitor, started = generator_monitor, time.perf_counter()
+    while monitor and (wait := monitor.ramp_wait()) and not stop_event.is_set(): stop_event.wait(wait)
+    if monitor: monitor.ramp_paused += time.perf_counter() - started
+    return not (monitor and monitor.ramp_wait() is None)
+
+async def async_hold_ramp():
+    monitor, started = generator_monitor, time.perf_counter()
+    while monitor and (wait := monitor.ramp_wait()) and not stop_event.is_set(): await asyncio.sleep(wait)
+    if monitor: monitor.ramp_paused += time.perf_counter() - started
+    return not (monitor and monitor.ramp_wait() is None)
+
+async def loop_lag_probe():
+    loop = asyncio.get_running_loop()
+    while True:
+        started = loop.time(); await asyncio.sleep(LOOP_PROBE_INTERVAL)
+        lag, monitor = loop.time() - started - LOOP_PROBE_INTERVAL, generator_monitor
+        if monitor and lag > monitor.loop_lag: monitor.loop_lag = lag
+
+# --- 2. ROTAS FLASK (controle do teste, status/SSE e rotas /agent/* do modo distribuído) ---
 
 @app.route('/')
 def index(): return flask.render_template_string(HTML_TEMPLATE)
@@ -112,30 +1478,81 @@ def health_check(): return flask.jsonify({"status": "ok"}), 200
 
 @app.route('/start_test', methods=['POST'])
 def start_test():
+    form_data = flask.request.form.to_dict(); params = {}
+    for key, value in form_data.items():
+        try: params[key] = float(value) if '.' in value else int(value)
+        except (ValueError, TypeError): params[key] = value
+    if not begin_test(params): return flask.jsonify({"error": "Test already running"}), 409
+    return flask.redirect(flask.url_for('index'))
+
+def begin_test(params):
     with state_lock:
-        if test_state["status"] in ["ramping", "running"]: return flask.jsonify({"error": "Test already running"}), 409
-        form_data = flask.request.form.to_dict(); params = {}
-        for key, value in form_data.items():
-            try: params[key] = float(value) if '.' in value else int(value)
-            except (ValueError, TypeError): params[key] = value
-        test_state.update({"params": params, "status": "idle", "results": [], "summary": {}, "live_stats": {"total": 0}, "time_series_data": []})
+        if test_state["status"] in ["ramping", "running", "stopping"]: return False
+        test_state.update({"params": params, "status": "idle", "results": [], "summary": {}, "live_stats": {"total": 0}, "time_series_data": [], "agents": [], "error": None})
+        with metrics_lock: result_queue.clear(); metrics.reset()
+        stop_event.clear(); status_stream.reset()
         threading.Thread(target=run_load_test, args=(test_state["params"],)).start()
-    return flask.redirect(flask.url_for('index'))
+    return True
 
 @app.route('/stop_test', methods=['POST'])
 def stop_test():
     with state_lock:
-        if test_state["status"] in ["ramping", "running"]: test_state["status"] = "stopping"
+        if test_state["status"] in ["ramping", "running"]: test_state["status"] = "stopping"; stop_event.set()
     return flask.redirect(flask.url_for('index'))
 
+@app.route('/agent/start', methods=['POST'])
+def agent_start():
+    if not begin_test(flask.request.get_json(force=True) or {}): return flask.jsonify({"error": "Test already running"}), 409
+    return flask.jsonify({"status": "started"}), 202
+
+@app.route('/agent/stop', methods=['POST'])
+def agent_stop():
+    stop_test()
+    return flask.jsonify({"status": "stopping"}), 200
+
+@app.route('/agent/metrics')
+def agent_metrics():
+    # O status é lido antes do snapshot: se já for "finished", o snapshot contém todos os resultados do teste.
+    with state_lock: status = test_state["status"]
+    with metrics_lock: snapshot = metrics.export()
+    return flask.jsonify({"status": status, "metrics": snapshot})
+
 @app.route('/get_status')
 def get_status():
+    # Resposta limitada: sem resultados brutos (veja /get_results) e, com ?since=<cursor>, só os pontos novos da série.
+    since = flask.request.args.get("since", type=int)
+    with metrics_lock: live_stats = metrics.live_stats()
     with state_lock:
-        total_reqs = len(test_state["results"])
-        if total_reqs > 0 and 'start_time' in test_state:
-            categorized_counts = Counter(categorize_result(r['status_code']) for r in test_state["results"])
-            test_state["live_stats"] = {"success": categorized_counts.get('success', 0), "errors": total_reqs - categorized_counts.get('success', 0), "total": total_reqs}
-        return flask.jsonify(test_state)
+        if live_stats["total"] > 0 and 'start_time' in test_state: test_state["live_stats"] = live_stats
+        series = test_state["time_series_data"]
+        payload = {key: test_state.get(key) for key in ("status", "params", "live_stats", "summary", "agents", "error", "results_log")}
+        payload.update({"time_series_data": series[since:] if since is not None else series[-STATUS_MAX_POINTS:], "cursor": len(series), "results_count": len(test_state["results"])})
+    return flask.jsonify(payload)
+
+@app.route('/get_results')
+def get_results():
+    offset, limit = max(0, flask.request.args.get("offset", 0, type=int)), min(RESULTS_PAGE_LIMIT, max(1, flask.request.args.get("limit", 1000, type=int)))
+    with state_lock: page, total = test_state["results"][offset:offset + limit], len(test_state["results"])
+    return flask.jsonify({"offset": offset, "total": total, "results": page})
+
+@app.route('/stream')
+def stream():
+    # Server-Sent Events: cada cliente recebe só os pontos de intervalo novos (serializados uma vez, na publicação) e o
+    # snapshot de contadores em cache, na cadência pedida em ?rate=<segundos>. Reconexões retomam pelo Last-Event-ID.
+    rate = min(STREAM_MAX_RATE, max(STREAM_MIN_RATE, flask.request.args.get("rate", STREAM_DEFAULT_RATE, type=float)))
+    last_event_id = flask.request.headers.get("Last-Event-ID", "")
+    cursor = int(last_event_id) + 1 if last_event_id.isdigit() else max(0, flask.request.args.get("since", 0, type=int))
+    def generate(cursor):
+        yield "retry: 3000\n\n"
+        while True:
+            events = status_stream.events_since(cursor); cursor += len(events)
+            status, snapshot = status_stream.snapshot(rate)
+            yield "".join(events) + snapshot
+            if status == "finished":
+                yield status_stream.summary_event()
+                return
+            time.sleep(rate)
+    return flask.Response(generate(cursor), mimetype="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
 # --- 3. TEMPLATE HTML (INTERFACE) ---
 HTML_TEMPLATE = """
@@ -176,11 +1593,35 @@ HTML_TEMPLATE = """
                         <div><label>Reqs/Usuário</label><input type="number" id="reqs_per_user" name="reqs_per_user" value="5" min="1" required></div>
                         <div><label>Ramp-up (s)</label><input type="number" id="ramp_up" name="ramp_up" value="5" min="0" required></div>
                     </div>
+                    <label for="load_model">Modelo de Carga</label><select id="load_model" name="load_model"><option value="closed">Fechado (usuários + intervalo)</option><option value="open">Aberto (taxa de chegada alvo)</option></select>
+                    <div id="open-model-div" style="display:none;">
+                        <div class="grid-3">
+                            <div><label>RPS Alvo</label><input type="number" name="target_rps" value="100" min="0" step="0.1"></div>
+                            <div><label>Duração (s)</label><input type="number" name="duration" value="60" min="1"></div>
+                            <div><label>Máx. em Voo</label><input type="number" name="max_in_flight" value="1000" min="1"></div>
+                        </div>
+                        <label>Perfil de Taxa (rps:segundos, ... — opcional, substitui RPS/Duração)</label><input type="text" name="rate_profile" placeholder="500:60, 1000:60, 2000:120">
+                        <div class="grid-2">
+                            <div><label>Forma do Perfil</label><select name="profile_shape"><option value="step">Degraus</option><option value="linear">Rampa linear</option></select></div>
+                            <div><label>Chegadas</label><select name="arrival"><option value="constant">Constantes</option><option value="poisson">Poisson</option></select></div>
+                        </div>
+                    </div>
+                    <label for="engine">Motor de Carga</label><select id="engine" name="engine"><option value="threads">Threads (1 thread por usuário)</option><option value="asyncio">Asyncio (corrotinas, alta concorrência)</option></select>
+                    <div class="grid-2">
+                        <div><label for="connection_mode">Conexões</label><select id="connection_mode" name="connection_mode"><option value="new">Nova por requisição</option><option value="per_user">Keep-alive por usuário</option><option value="keep_alive">Pool keep-alive compartilhado</option></select></div>
+                        <div><label for="pool_size">Tamanho do Pool</label><input type="number" id="pool_size" name="pool_size" value="100" min="1"></div>
+                    </div>
                     <label for="delay_type">Tipo de Intervalo</label><select id="delay_type" name="delay_type"><option value="constant">Constante</option><option value="variable">Variável</option></select>
                     <div id="constant-delay-div"><label for="delay_constant">Intervalo (s)</label><input type="number" id="delay_constant" name="delay_constant" value="1" min="0" step="0.1"></div>
                     <div id="variable-delay-div" style="display:none;"><div class="grid-2"><div><label>Min (s)</label><input type="number" name="delay_min" value="0.5"></div><div><label>Max (s)</label><input type="number" name="delay_max" value="2.0"></div></div></div>
                     <label for="method">Método HTTP</label><select id="method" name="method"><option value="GET">GET</option><option value="POST">POST</option><option value="PUT">PUT</option></select>
                     <div id="post-put-options" style="display:none;"><label>Cabeçalhos</label><textarea name="headers" placeholder="Content-Type: application/json"></textarea><label>Corpo (JSON)</label><textarea name="body" placeholder='{"key": "value"}'></textarea></div>
+                    <label for="scenario">Cenário (JSON, opcional; substitui método, cabeçalhos e corpo, e URLs "/..." usam a origem da URL de destino)</label><textarea id="scenario" name="scenario" placeholder='{"steps": [{"name": "login", "once": true, "method": "POST", "url": "/login", "body": {"user": "demo"}, "extract": {"token": "$.token"}}, {"name": "listar", "weight": 3, "url": "/items", "headers": {"Authorization": "Bearer &#123;&#123;token&#125;&#125;"}, "extract": {"item": "$.items[0].id"}, "think_time": [0.5, 1.5]}, {"name": "detalhe", "weight": 1, "repeat": 5, "url": "/items/&#123;&#123;item&#125;&#125;"}]}'></textarea>
+                    <label for="data_file">Arquivo de Dados (JSONL no gerador; preenche &#123;&#123;variável&#125;&#125; na URL, cabeçalhos e corpo)</label><input type="text" id="data_file" name="data_file" placeholder="/caminho/usuarios.jsonl">
+                    <label for="processes">Processos Locais</label><input type="number" id="processes" name="processes" value="1" min="1">
+                    <label for="agents">Agentes Remotos (uma URL por linha)</label><textarea id="agents" name="agents" placeholder="http://10.0.0.12:5000"></textarea>
+                    <label><input type="checkbox" name="keep_raw_results" style="width:auto; margin-right:8px;">Guardar resultados brutos por requisição (memória cresce com o teste)</label>
+                    <label><input type="checkbox" name="auto_tune" style="width:auto; margin-right:8px;">Ajustar concorrência se o gerador saturar (pausa o ramp-up e encerra parte dos usuários)</label>
                     <button id="start-btn" type="submit" class="btn btn-start">Iniciar Teste</button><button id="stop-btn" type="button" class="btn btn-stop" style="display:none;">Parar Teste</button>
                 </form>
             </div>
@@ -201,6 +1642,8 @@ HTML_TEMPLATE = """
                 <h2>Gráficos de Performance</h2>
                 <div class="chart-section"><h3 style="margin-bottom: 20px;">Requisições por Segundo (RPS)</h3><div class="chart-wrapper"><canvas id="rps-chart"></canvas></div></div>
                 <div class="chart-section"><h3 style="margin-bottom: 20px;">Tempo de Resposta Médio (Sucessos)</h3><div class="chart-wrapper"><canvas id="response-time-chart"></canvas></div></div>
+                <div class="chart-section"><h3 style="margin-bottom: 20px;">Fases da Requisição (Média por Intervalo)</h3><div class="chart-wrapper"><canvas id="phases-chart"></canvas></div></div>
+                <div class="chart-section"><h3 style="margin-bottom: 20px;">Saúde do Gerador (pontos vermelhos = saturado)</h3><div class="chart-wrapper"><canvas id="generator-chart"></canvas></div></div>
                 <div class="chart-section"><h3 style="margin-bottom: 5px;">Distribuição de Respostas (Final)</h3><div id="summary-legend"><span class="legend-item"><div class="legend-color-box" style="background-color: rgba(40, 167, 69, 0.8);"></div>Sucesso (2xx)</span><span class="legend-item"><div class="legend-color-box" style="background-color: rgba(108, 92, 231, 0.8);"></div>Rate Limit (429)</span><span class="legend-item"><div class="legend-color-box" style="background-color: rgba(255, 193, 7, 0.8);"></div>Erro Cliente (4xx)</span><span class="legend-item"><div class="legend-color-box" style="background-color: rgba(220, 53, 69, 0.8);"></div>Erro Servidor (5xx)</span><span class="legend-item"><div class="legend-color-box" style="background-color: rgba(108, 117, 125, 0.8);"></div>Erro Rede/Timeout</span></div><div class="chart-wrapper"><canvas id="summary-chart"></canvas></div></div>
             </div>
         </div>
@@ -211,7 +1654,8 @@ HTML_TEMPLATE = """
     const statusText = document.getElementById('status-text'), progressText = document.getElementById('progress-text');
     const liveSuccessCount = document.getElementById('live-success-count'), liveErrorCount = document.getElementById('live-error-count');
     const summaryTable = document.getElementById('summary-table');
-    let statusInterval, summaryChart, rpsChart, responseTimeChart;
+    let statusStream, summaryChart, rpsChart, responseTimeChart, phasesChart, generatorChart;
+    const phaseConfigs = { keys: ['dns', 'connect', 'tls', 'ttfb', 'body'], labels: { dns: 'DNS', connect: 'Conexão TCP', tls: 'Handshake TLS', ttfb: 'Primeiro Byte (TTFB)', body: 'Download do Corpo' }, colors: { dns: '#6c757d', connect: '#17a2b8', tls: '#6f42c1', ttfb: '#fd7e14', body: '#28a745' } };
     const chartConfigs = {
         keys: ['success', 'rate_limit', 'client_error', 'server_error', 'network_error'],
         colors: { success: 'rgba(40, 167, 69, 0.7)', rate_limit: 'rgba(108, 92, 231, 0.7)', client_error: 'rgba(255, 193, 7, 0.7)', server_error: 'rgba(220, 53, 69, 0.7)', network_error: 'rgba(108, 117, 125, 0.7)' },
@@ -219,6 +1663,7 @@ HTML_TEMPLATE = """
     };
     document.getElementById('delay_type').addEventListener('change', e => { document.getElementById('constant-delay-div').style.display = e.target.value === 'constant' ? 'block' : 'none'; document.getElementById('variable-delay-div').style.display = e.target.value === 'variable' ? 'block' : 'none'; });
     document.getElementById('method').addEventListener('change', e => { document.getElementById('post-put-options').style.display = ['POST', 'PUT'].includes(e.target.value) ? 'block' : 'none'; });
+    document.getElementById('load_model').addEventListener('change', e => { document.getElementById('open-model-div').style.display = e.target.value === 'open' ? 'block' : 'none'; });
     document.getElementById('delay_type').dispatchEvent(new Event('change'));
     stopBtn.addEventListener('click', () => fetch('/stop_test', { method: 'POST' }));
     testForm.addEventListener('submit', (e) => { e.preventDefault(); fetch('/start_test', { method: 'POST', body: new FormData(testForm) }).then(res => res.ok && startMonitoring()); });
@@ -234,11 +1679,11 @@ HTML_TEMPLATE = """
         // quando um NOVO teste é iniciado.
         initializeCharts();
         
-        statusInterval = setInterval(updateStatus, 5000);
+        openStatusStream();
     }
 
     function initializeCharts() {
-        if(summaryChart) summaryChart.destroy(); if(rpsChart) rpsChart.destroy(); if(responseTimeChart) responseTimeChart.destroy();
+        if(summaryChart) summaryChart.destroy(); if(rpsChart) rpsChart.destroy(); if(responseTimeChart) responseTimeChart.destroy(); if(phasesChart) phasesChart.destroy(); if(generatorChart) generatorChart.destroy();
 
         summaryChart = new Chart(document.getElementById('summary-chart'), { type: 'doughnut', data: { labels: Object.values(chartConfigs.labels), datasets: [{ data: [], backgroundColor: Object.values(chartConfigs.colors), borderWidth: 0 }] }, options: { responsive: true, maintainAspectRatio: false, plugins: { legend: { display: false } } } });
         
@@ -254,43 +1699,84 @@ HTML_TEMPLATE = """
             }
         });
         
-        responseTimeChart = new Chart(document.getElementById('response-time-chart'), { type: 'line', data: { labels: [], datasets: [{ label: 'Tempo Médio (s)', data: [], borderColor: '#28a745', tension: 0.3, fill: false, pointRadius: 2 }] }, options: { responsive: true, maintainAspectRatio: false, scales: { y: { beginAtZero: true, title: { display: true, text: 'Segundos' } } }, animation: false } });
+        responseTimeChart = new Chart(document.getElementById('response-time-chart'), { type: 'line', data: { labels: [], datasets: [{ label: 'Tempo Médio (s)', data: [], borderColor: '#28a745', tension: 0.3, fill: false, pointRadius: 2 }, { label: 'p95 (s)', data: [], borderColor: '#fd7e14', tension: 0.3, fill: false, pointRadius: 2 }, { label: 'p99 (s)', data: [], borderColor: '#dc3545', tension: 0.3, fill: false, pointRadius: 2 }] }, options: { responsive: true, maintainAspectRatio: false, scales: { y: { beginAtZero: true, title: { display: true, text: 'Segundos' } } }, animation: false } });
+        phasesChart = new Chart(document.getElementById('phases-chart'), { type: 'line', data: { labels: [], datasets: phaseConfigs.keys.map(key => ({ label: phaseConfigs.labels[key], data: [], borderColor: phaseConfigs.colors[key], tension: 0.3, fill: false, pointRadius: 2, spanGaps: true, key: key })) }, options: { responsive: true, maintainAspectRatio: false, scales: { y: { beginAtZero: true, title: { display: true, text: 'Segundos' } } }, animation: false } });
+        const saturatedColor = context => context.raw && context.raw.saturated ? '#dc3545' : context.dataset.borderColor;
+        generatorChart = new Chart(document.getElementById('generator-chart'), { type: 'line', data: { labels: [], datasets: [{ label: 'CPU do Gerador (%)', data: [], borderColor: '#6f42c1', tension: 0.3, fill: false, pointRadius: 3, pointBackgroundColor: saturatedColor, yAxisID: 'cpu' }, { label: 'Atraso Máx. (s)', data: [], borderColor: '#fd7e14', tension: 0.3, fill: false, pointRadius: 3, pointBackgroundColor: saturatedColor, yAxisID: 'lag' }] }, options: { responsive: true, maintainAspectRatio: false, parsing: { xAxisKey: 'x', yAxisKey: 'y' }, scales: { cpu: { position: 'left', beginAtZero: true, title: { display: true, text: 'CPU %' } }, lag: { position: 'right', beginAtZero: true, grid: { drawOnChartArea: false }, title: { display: true, text: 'Segundos' } } }, animation: false } });
     }
 
-    function updateStatus() {
-        fetch('/get_status').then(res => res.json()).then(data => {
-            statusText.textContent = data.status.charAt(0).toUpperCase() + data.status.slice(1);
-            const target = (data.params.users || 0) * (data.params.reqs_per_user || 0);
-            progressText.textContent = `${data.live_stats.total || 0} / ${target}`;
-            liveSuccessCount.textContent = data.live_stats.success || 0;
-            liveErrorCount.textContent = data.live_stats.errors || 0;
-
-            if (data.time_series_data) {
-                const labels = data.time_series_data.map(d => d.timestamp);
-                rpsChart.data.labels = labels;
-                rpsChart.data.datasets.forEach(dataset => { dataset.data = data.time_series_data.map(d => d.rates[dataset.key] || 0); });
-                rpsChart.update();
-                responseTimeChart.data.labels = labels;
-                responseTimeChart.data.datasets[0].data = data.time_series_data.map(d => d.avg_response_time);
-                responseTimeChart.update();
-            }
-
-            if (data.status === 'finished') {
-                // ### PONTO-CHAVE ###
-                // Ao finalizar, a atualização é parada. Nenhum comando para limpar os
-                // gráficos de linha é chamado aqui. Eles permanecem na tela com os
-                // últimos dados recebidos, como solicitado.
-                clearInterval(statusInterval);
-                startBtn.disabled = false; stopBtn.style.display = 'none';
-                displaySummary(data.summary);
-            }
+    function openStatusStream() {
+        // O servidor envia por SSE apenas o que mudou: 'counters' (contadores), 'interval' (cada ponto novo da série,
+        // uma única vez) e 'summary' (fim do teste). Em caso de reconexão o EventSource retoma pelo último id recebido.
+        if (statusStream) statusStream.close();
+        statusStream = new EventSource('/stream?rate=2');
+        statusStream.addEventListener('counters', e => updateCounters(JSON.parse(e.data)));
+        statusStream.addEventListener('interval', e => appendInterval(JSON.parse(e.data)));
+        statusStream.addEventListener('summary', e => {
+            // ### PONTO-CHAVE ###
+            // Ao finalizar, a atualização é parada. Nenhum comando para limpar os
+            // gráficos de linha é chamado aqui. Eles permanecem na tela com os
+            // últimos dados recebidos, como solicitado.
+            statusStream.close();
+            startBtn.disabled = false; stopBtn.style.display = 'none';
+            displaySummary(JSON.parse(e.data));
         });
     }
 
+    function updateCounters(data) {
+        statusText.textContent = data.status.charAt(0).toUpperCase() + data.status.slice(1);
+        progressText.textContent = `${data.live_stats.total || 0} / ${data.target}`;
+        liveSuccessCount.textContent = data.live_stats.success || 0;
+        liveErrorCount.textContent = data.live_stats.errors || 0;
+    }
+
+    function appendInterval(point) {
+        rpsChart.data.labels.push(point.timestamp);
+        rpsChart.data.datasets.forEach(dataset => dataset.data.push(point.rates[dataset.key] || 0));
+        rpsChart.update();
+        responseTimeChart.data.labels.push(point.timestamp);
+        responseTimeChart.data.datasets[0].data.push(point.avg_response_time);
+        responseTimeChart.data.datasets[1].data.push(point.p95);
+        responseTimeChart.data.datasets[2].data.push(point.p99);
+        responseTimeChart.update();
+        phasesChart.data.labels.push(point.timestamp);
+        phasesChart.data.datasets.forEach(dataset => dataset.data.push(point.phases && point.phases[dataset.key] !== undefined ? point.phases[dataset.key] : null));
+        phasesChart.update();
+        if (point.generator) {
+            const gen = point.generator, lag = Math.max(parseFloat(gen.lag), parseFloat(gen.drift));
+            generatorChart.data.labels.push(point.timestamp);
+            generatorChart.data.datasets[0].data.push({ x: point.timestamp, y: parseFloat(gen.cpu), saturated: gen.saturated });
+            generatorChart.data.datasets[1].data.push({ x: point.timestamp, y: lag, saturated: gen.saturated });
+            generatorChart.update();
+        }
+    }
+
     function displaySummary(summary) {
         resultsContainer.style.display = 'none'; summaryContainer.style.display = 'block';
         if (!summary || Object.keys(summary).length === 0) { summaryTable.innerHTML = '<tr><td>Nenhum resultado para exibir.</td></tr>'; return; }
-        let html = `<tr><td>Duração Total</td><td>${summary.total_duration}s</td></tr><tr><td>Total de Requisições</td><td>${summary.total_requests}</td></tr><tr><td>RPS (Média)</td><td>${summary.rps}</td></tr><tr><td colspan="2" style="background-color:#f2f2f2;"><strong>Estatísticas de Resposta (sucessos)</strong></td></tr><tr><td>Tempo Médio</td><td>${summary.avg_response_time || 'N/A'}s</td></tr><tr><td>Tempo Mínimo</td><td>${summary.min_response_time || 'N/A'}s</td></tr><tr><td>Tempo Máximo</td><td>${summary.max_response_time || 'N/A'}s</td></tr><tr><td>Mediana (p50)</td><td>${summary.p50_median || 'N/A'}s</td></tr><tr><td>Percentil 95 (p95)</td><td>${summary.p95 || 'N/A'}s</td></tr>`;
+        let html = `<tr><td>Duração Total</td><td>${summary.total_duration}s</td></tr><tr><td>Total de Requisições</td><td>${summary.total_requests}</td></tr><tr><td>RPS (Média)</td><td>${summary.rps}</td></tr><tr><td colspan="2" style="background-color:#f2f2f2;"><strong>Estatísticas de Resposta (sucessos)</strong></td></tr><tr><td>Tempo Médio</td><td>${summary.avg_response_time || 'N/A'}s</td></tr><tr><td>Tempo Mínimo</td><td>${summary.min_response_time || 'N/A'}s</td></tr><tr><td>Tempo Máximo</td><td>${summary.max_response_time || 'N/A'}s</td></tr><tr><td>Mediana (p50)</td><td>${summary.p50_median || 'N/A'}s</td></tr><tr><td>Percentil 95 (p95)</td><td>${summary.p95 || 'N/A'}s</td></tr><tr><td>Percentil 99 (p99)</td><td>${summary.p99 || 'N/A'}s</td></tr>`;
+        if (summary.scheduler) {
+            const sched = summary.scheduler;
+            html += `<tr><td colspan="2" style="background-color:#f2f2f2;"><strong>Agendador (modelo aberto)</strong></td></tr><tr><td>RPS Planejado</td><td>${sched.intended_rps}</td></tr><tr><td>Planejadas / Enviadas</td><td>${sched.intended} / ${sched.sent}</td></tr><tr><td>Descartadas (máx. em voo)</td><td>${sched.dropped}</td></tr><tr><td>Atrasadas (> 10 ms)</td><td>${sched.late}</td></tr><tr><td>Maior Atraso de Envio</td><td>${sched.max_send_lag}s</td></tr>`;
+        }
+        if (summary.connection_reuse) {
+            const reuse = summary.connection_reuse;
+            html += `<tr><td colspan="2" style="background-color:#f2f2f2;"><strong>Conexões</strong></td></tr><tr><td>Reutilizadas / Novas</td><td>${reuse.reused} / ${reuse.new}</td></tr><tr><td>Tempo Médio (reutilizadas)</td><td>${reuse.avg_response_time_reused || 'N/A'}s</td></tr><tr><td>Tempo Médio (novas)</td><td>${reuse.avg_response_time_new || 'N/A'}s</td></tr>`;
+        }
+        if (summary.phases) {
+            html += `<tr><td colspan="2" style="background-color:#f2f2f2;"><strong>Fases da Requisição</strong></td></tr>`;
+            for (const key of phaseConfigs.keys) { const phase = summary.phases[key]; if (phase) html += `<tr><td>${phaseConfigs.labels[key]}</td><td>média ${phase.avg}s | p50 ${phase.p50}s | p95 ${phase.p95}s | p99 ${phase.p99}s | máx ${phase.max}s (${phase.count})</td></tr>`; }
+            if (summary.transfer) html += `<tr><td>Bytes Recebidos (corpo)</td><td>${summary.transfer.bytes_received} (média ${summary.transfer.avg_bytes} B, ${summary.transfer.throughput} B/s)</td></tr>`;
+        }
+        if (summary.generator) {
+            const gen = summary.generator, warning = gen.saturated_samples > 0 ? ' style="color:#dc3545;"' : '';
+            html += `<tr><td colspan="2" style="background-color:#f2f2f2;"><strong>Saúde do Gerador</strong></td></tr><tr><td>Amostras Saturadas</td><td${warning}>${gen.saturated_samples} / ${gen.samples} (${gen.saturated_pct}%)${gen.saturated_samples > 0 ? ' - latências desses intervalos incluem a fila do próprio gerador' : ''}</td></tr><tr><td>CPU Média / Máx.</td><td>${gen.avg_cpu}% / ${gen.max_cpu}%</td></tr><tr><td>Atraso Máx. (loop/threads)</td><td>${gen.max_lag}s</td></tr><tr><td>Atraso Máx. de Envio</td><td>${gen.max_send_drift}s</td></tr><tr><td>Usuários Ativos (máx.)</td><td>${gen.max_users}</td></tr>`;
+            if (gen.auto_tune) html += `<tr><td>Ajuste Automático</td><td>ramp-up pausado ${gen.auto_tune.ramp_paused}s | usuários encerrados ${gen.auto_tune.retired_users}</td></tr>`;
+        }
+        if (summary.steps) {
+            html += `<tr><td colspan="2" style="background-color:#f2f2f2;"><strong>Etapas do Cenário</strong></td></tr>`;
+            for (const [name, step] of Object.entries(summary.steps)) html += `<tr><td>${name}</td><td>${step.total} req (${step.errors} erros) | média ${step.avg_response_time}s | p50 ${step.p50}s | p95 ${step.p95}s | p99 ${step.p99}s</td></tr>`;
+        }
         summaryTable.innerHTML = html;
         if (summary.categorized_distribution) {
             const dist = summary.categorized_distribution;
@@ -303,8 +1789,155 @@ HTML_TEMPLATE = """
 </html>
 """
 
-# --- 4. BLOCO DE EXECUÇÃO PRINCIPAL (Sem alterações) ---
+# --- 4. MICROBENCHMARKS (python LoadTester.py --bench <nome>) ---
+
+def benchmark_recording(user_counts=(1000, 10000, 50000), records_per_run=200000):
+    # Custo de gravação por requisição: caminho antigo (state_lock duas vezes por requisição, /get_status varrendo a lista
+    # de resultados sob o mesmo lock) contra o atual (stop_event + deque drenada pelo coletor). Os usuários são corrotinas
+    # e um poller concorrente imita o /get_status a cada 5 ms; o tempo de um laço sem gravação é descontado.
+    sample = {"status_code": 200, "duration": 0.01, "error": None, "connection_reused": None}
+    legacy_lock, legacy_state = threading.Lock(), {"status": "running", "results": []}
+
+    def legacy_record():
+        with legacy_lock:
+            if legacy_state["status"] not in ["ramping", "running"]: return
+        with legacy_lock:
+            if legacy_state["status"] in ["ramping", "running"]: legacy_state["results"].append(sample)
+
+    def legacy_poll():
+        with legacy_lock: Counter(categorize_result(r['status_code']) for r in legacy_state["results"])
+
+    def current_poll():
+        with metrics_lock: metrics.live_stats()
+
+    def run(users, per_user, record, poll, collect):
+        done = threading.Event()
+        def poller():
+            while not done.is_set(): poll(); time.sleep(0.005)
+        def collector():
+            while not done.is_set(): time.sleep(COLLECT_INTERVAL); collect()
+        async def user():
+            for _ in range(per_user): record(); await asyncio.sleep(0)
+        async def main(): await asyncio.gather(*(user() for _ in range(users)))
+        threads = [threading.Thread(target=poller), threading.Thread(target=collector)]
+        for thread in threads: thread.start()
+        start = time.perf_counter(); asyncio.run(main()); elapsed = time.perf_counter() - start
+        done.set()
+        for thread in threads: thread.join()
+        collect()
+        return elapsed / (users * per_user) * 1e9
+
+    test_state["params"] = {}; stop_event.clear()
+    print(f"{'usuários':>10} {'reqs':>9} {'antigo (ns/req)':>16} {'atual (ns/req)':>15}")
+    for users in user_counts:
+        per_user = max(1, records_per_run // users)
+        legacy_state["results"] = []; result_queue.clear(); metrics.reset()
+        baseline = run(users, per_user, lambda: None, lambda: None, lambda: None)
+        legacy = run(users, per_user, legacy_record, legacy_poll, lambda: None) - baseline
+        current = run(users, per_user, lambda: record_result(sample), current_poll, drain_results) - baseline
+        assert metrics.total == users * per_user
+        print(f"{users:>10} {users * per_user:>9} {legacy:>16.0f} {current:>15.0f}")
+
+def benchmark_templates(iterations=20000):
+    # CPU do cliente por requisição (time.process_time), sem rede: um adaptador nulo devolve 200 sem abrir sockets, então
+    # sobra só o preparo da requisição. Antigo = json.loads + Session.request (merge de cabeçalhos/ambiente a cada envio)
+    # e json.loads/json.dumps + urlsplit + montagem do cabeçalho no asyncio; atual = RequestTemplate.
+    class NullAdapter(HTTPAdapter):
+        def send(self, request, **kwargs):
+            response = requests.Response(); response.status_code, response.request, response.url, response._content = 200, request, request.url, b""
+            return response
+
+    url, method = "http://127.0.0.1:8080/api/orders?source=bench", "POST"
+    headers = {"Authorization": "Bearer 0123456789abcdef", "X-Client": "LoadTester"}
+    body = json.dumps({"customer": {"id": 42, "name": "Maria", "tags": ["a", "b", "c"]}, "items": [{"sku": f"SKU-{i}", "qty": i, "price": 9.9} for i in range(20)]})
+    static = RequestTemplate(method, url, headers, body)
+    dynamic = RequestTemplate(method, url + "&user={{id}}", {**headers, "X-User": "{{name}}"}, body.replace('"Maria"', '"{{name}}"').replace("42", "{{id}}"))
+    row = {"id": 7, "name": "João"}
+    session = requests.Session(); session.mount("http://", NullAdapter())
+
+    def legacy_threads():
+        session.request(method, url, headers=headers, json=json.loads(body), timeout=REQUEST_TIMEOUT)
+
+    def legacy_async():
+        build_request(method, urlsplit(url), headers, json.dumps(json.loads(body)).encode(), keep_alive=True)
+
+    def measure(call):
+        start = time.process_time()
+        for _ in range(iterations): call()
+        return (time.process_time() - start) / iterations * 1e6
+
+    cases = [("threads", legacy_threads, lambda: send_prepared(session, *static.prepare()), lambda: send_prepared(session, *dynamic.prepare(row))),
+        ("asyncio", legacy_async, lambda: static.payload(keep_alive=True), lambda: dynamic.payload(row, keep_alive=True))]
+    print(f"{'motor':>8} {'antigo (µs/req)':>16} {'atual (µs/req)':>15} {'com data_file (µs/req)':>23}")
+    for name, legacy, current, templated in cases:
+        print(f"{name:>8} {measure(legacy):>16.1f} {measure(current):>15.1f} {measure(templated):>23.1f}")
+    session.close()
+
+def benchmark_http_server(port_queue):
+    # Servidor HTTP/1.1 keep-alive mínimo em outro processo, para que o tempo de CPU medido seja só o do cliente.
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version, disable_nagle_algorithm = "HTTP/1.1", True
+        def do_GET(self):
+            self.send_response(200); self.send_header("Content-Length", "2"); self.end_headers(); self.wfile.write(b"ok")
+        def log_message(self, *args): pass
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler); server.daemon_threads = True
+    port_queue.put(server.server_address[1]); server.serve_forever()
+
+def benchmark_phases(requests_per_run=1000, rounds=15):
+    # Custo da instrumentação de fases: CPU do cliente por requisição (time.process_time) em conexão keep-alive local,
+    # com e sem medição de fases, mais o custo extra no coletor (MetricsAggregator.record com 5 fases). As duas variantes
+    # rodam intercaladas (ordem alternada a cada rodada) para que a deriva da máquina afete ambas: µs/req é o melhor de
+    # rounds e o overhead é a mediana das razões de cada par, menos sensível a rodadas isoladas ruidosas.
+    context = multiprocessing.get_context("spawn")
+    port_queue = context.Queue(); server = context.Process(target=benchmark_http_server, args=(port_queue,), daemon=True); server.start()
+    template = RequestTemplate("GET", f"http://127.0.0.1:{port_queue.get(timeout=10)}/", {}, "")
+    # O caminho sem fases é o mesmo worker()/send_prepared (stream=True, leitura do corpo), só que com as classes de pool
+    # e conexão originais do urllib3: a diferença medida é a dos wrappers PhaseTiming*/_make_request.
+    plain, tracked = requests.Session(), create_session(1)
+    plain.mount("http://", HTTPAdapter(pool_connections=10, pool_maxsize=1, pool_block=False))
+
+    async def run_async(timed):
+        pool = AsyncConnectionPool(1, None)
+        for _ in range(requests_per_run): await async_worker(template, None, pool, timed=timed)
+        pool.close()
+
+    def cpu(untimed, timed):
+        pairs = []
+        for round_index in range(rounds):
+            pair = [0.0, 0.0]
+            for side in ((0, 1) if round_index % 2 == 0 else (1, 0)):
+                start = time.process_time(); (untimed, timed)[side](); pair[side] = time.process_time() - start
+            pairs.append(pair)
+        ratios = sorted(timed_cpu / untimed_cpu for untimed_cpu, timed_cpu in pairs)
+        return min(pair[0] for pair in pairs) / requests_per_run * 1e6, min(pair[1] for pair in pairs) / requests_per_run * 1e6, (ratios[len(ratios) // 2] - 1) * 100
+
+    timed_result = worker(template, tracked)
+    plain_result = {key: value for key, value in timed_result.items() if key != "phases"}
+    def record(result):
+        aggregator = MetricsAggregator()
+        return lambda: [aggregator.record(result) for _ in range(requests_per_run)]
+
+    rows = [("threads", *cpu(lambda: [worker(template, plain) for _ in range(requests_per_run)], lambda: [worker(template, tracked) for _ in range(requests_per_run)])),
+        ("asyncio", *cpu(lambda: asyncio.run(run_async(False)), lambda: asyncio.run(run_async(True)))),
+        ("coletor", *cpu(record(plain_result), record(timed_result)))]
+    print(f"{'caminho':>8} {'sem fases (µs/req)':>19} {'com fases (µs/req)':>19} {'overhead':>9}")
+    for name, untimed, timed, overhead in rows: print(f"{name:>8} {untimed:>19.1f} {timed:>19.1f} {overhead:>8.1f}%")
+    plain.close(); tracked.close(); server.terminate()
+
+BENCHMARKS = {"recording": benchmark_recording, "templates": benchmark_templates, "phases": benchmark_phases}
+
+# --- 5. BLOCO DE EXECUÇÃO PRINCIPAL ---
 if __name__ == '__main__':
-    parser = ArgumentParser(); parser.add_argument('--host', default='127.0.0.1', help='Host a ser vinculado (ex: 0.0.0.0)'); parser.add_argument('--port', default=5000, type=int, help='Porta para escutar'); args = parser.parse_args()
+    parser = ArgumentParser(); parser.add_argument('--host', default='127.0.0.1', help='Host a ser vinculado (ex: 0.0.0.0)'); parser.add_argument('--port', default=5000, type=int, help='Porta para escutar')
+    parser.add_argument('--bench', choices=sorted(BENCHMARKS), help='Executa um microbenchmark e encerra')
+    parser.add_argument('--results-dir', help='Diretório onde cada teste grava seu log binário de resultados (.ltlog)')
+    parser.add_argument('--replay', metavar='ARQUIVO', help='Recalcula resumo e série temporal de um log .ltlog e encerra')
+    parser.add_argument('--window-start', type=float, help='Início da janela do replay (s desde o início do teste)'); parser.add_argument('--window-end', type=float, help='Fim da janela do replay (s desde o início do teste)')
+    parser.add_argument('--interval', type=float, default=10.0, help='Largura dos intervalos da série temporal do replay (s)'); args = parser.parse_args()
+    if args.bench: BENCHMARKS[args.bench](); raise SystemExit(0)
+    if args.replay: print(json.dumps(replay_results_log(args.replay, args.window_start, args.window_end, args.interval), indent=2)); raise SystemExit(0)
+    app.config["RESULTS_DIR"] = args.results_dir
     aggregator_thread = threading.Thread(target=data_aggregator, daemon=True); aggregator_thread.start()
+    collector_thread = threading.Thread(target=result_collector, daemon=True); collector_thread.start()
     app.run(host=args.host, port=args.port, debug=False)